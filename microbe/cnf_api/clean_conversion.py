@@ -1,6 +1,8 @@
 import pandas as pd
 import os
 
+from cnf_csv import build_snapshot, pa
+
 # Paths
 base_dir = r"/api_data/CNF"
 conversion_file = os.path.join(base_dir, "CONVERSION FACTOR.csv")
@@ -22,3 +24,7 @@ after = len(conversion_df_cleaned)
 conversion_df_cleaned.to_csv(conversion_file, index=False, encoding="latin-1")
 
 print(f"Removed {before - after} invalid MeasureID rows from CONVERSION FACTOR.csv")
+
+# The snapshot was built from the uncleaned file; rebuild it
+if pa is not None:
+    build_snapshot(base_dir)
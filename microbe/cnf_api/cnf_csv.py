@@ -0,0 +1,235 @@
+# Column-wise readers for the Canadian Nutrient File (2015) CSVs and their Arrow snapshot
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import Date, Float, Integer
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # optional: without pyarrow every read goes to the CSVs
+    pa = None
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api_data", "CNF")
+
+# Folder (inside the data folder) holding one Arrow IPC file per table plus manifest.json
+SNAPSHOT_DIR_NAME = "snapshot"
+
+# Table name -> (CSV file, {model column: CSV column}), in foreign-key load order.
+# CSV column names are given with spaces removed, as in the original loaders.
+CNF_CSV_FILES = {
+    'food_group': ("FOOD GROUP.csv", {
+        'food_group_id': 'FoodGroupID', 'code': 'FoodGroupCode', 'name': 'FoodGroupName', 'name_fr': 'FoodGroupNameF'}),
+    'food_source': ("FOOD SOURCE.csv", {
+        'food_source_id': 'FoodSourceID', 'code': 'FoodSourceCode', 'description': 'FoodSourceDescription',
+        'description_fr': 'FoodSourceDescriptionF'}),
+    'nutrient_name': ("NUTRIENT NAME.csv", {
+        'nutrient_name_id': 'NutrientID', 'code': 'NutrientCode', 'symbol': 'NutrientSymbol', 'unit': 'NutrientUnit',
+        'name': 'NutrientName', 'name_fr': 'NutrientNameF', 'tagname': 'Tagname', 'decimals': 'NutrientDecimals'}),
+    'nutrient_source': ("NUTRIENT SOURCE.csv", {
+        'nutrient_source_id': 'NutrientSourceID', 'code': 'NutrientSourceCode',
+        'description': 'NutrientSourceDescription', 'description_fr': 'NutrientSourcDescriptionF'}),
+    'measure_name': ("MEASURE NAME.csv", {
+        'measure_id': 'MeasureID', 'name': 'MeasureDescription', 'name_fr': 'MeasureDescriptionF'}),
+    'refuse_name': ("REFUSE NAME.csv", {
+        'refuse_id': 'RefuseID', 'name': 'RefuseDescription', 'name_fr': 'RefuseDescriptionF'}),
+    'yield_name': ("YIELD NAME.csv", {
+        'yield_id': 'YieldID', 'name': 'YieldDescription', 'name_fr': 'YieldDescriptionF'}),
+    'food': ("FOOD NAME.csv", {
+        'food_id': 'FoodID', 'food_code': 'FoodCode', 'food_group_id': 'FoodGroupID',
+        'food_source_id': 'FoodSourceID', 'description': 'FoodDescription', 'description_fr': 'FoodDescriptionF',
+        'country_code': 'CountryCode', 'date_of_entry': 'FoodDateOfEntry',
+        'date_of_publication': 'FoodDateOfPublication', 'scientific_name': 'ScientificName'}),
+    'nutrient_amount': ("NUTRIENT AMOUNT.csv", {
+        'food_id': 'FoodID', 'nutrient_name_id': 'NutrientID', 'nutrient_source_id': 'NutrientSourceID',
+        'value': 'NutrientValue', 'standard_error': 'StandardError', 'num_observations': 'NumberofObservations',
+        'date_of_entry': 'NutrientDateOfEntry'}),
+    'conversion_factor': ("CONVERSION FACTOR.csv", {
+        'food_id': 'FoodID', 'measure_id': 'MeasureID', 'value': 'ConversionFactorValue',
+        'date_of_entry': 'ConvFactorDateOfEntry'}),
+    'refuse_amount': ("REFUSE AMOUNT.csv", {
+        'food_id': 'FoodID', 'refuse_id': 'RefuseID', 'amount': 'RefuseAmount',
+        'date_of_entry': 'RefuseDateOfEntry'}),
+    'yield_amount': ("YIELD AMOUNT.csv", {
+        'food_id': 'FoodID', 'yield_id': 'YieldID', 'amount': 'YieldAmount', 'date_of_entry': 'YieldDateofEntry'}),
+}
+
+
+# Natural key of each table (model columns); rows repeating a key are dropped from the snapshot
+CNF_NATURAL_KEYS = {
+    'food_group': ['food_group_id'],
+    'food_source': ['food_source_id'],
+    'nutrient_name': ['nutrient_name_id'],
+    'nutrient_source': ['nutrient_source_id'],
+    'measure_name': ['measure_id'],
+    'refuse_name': ['refuse_id'],
+    'yield_name': ['yield_id'],
+    'food': ['food_id'],
+    'nutrient_amount': ['food_id', 'nutrient_name_id'],
+    'conversion_factor': ['food_id', 'measure_id'],
+    'refuse_amount': ['food_id', 'refuse_id'],
+    'yield_amount': ['food_id', 'yield_id'],
+}
+
+
+def data_version(data_dir=DATA_DIR):
+    """Fingerprint of the CNF CSVs (name, size, mtime); changes whenever any of them is rewritten."""
+    digest = hashlib.sha1()
+    for filename, _ in sorted(CNF_CSV_FILES.values()):
+        path = os.path.join(data_dir, filename)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{filename}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+def normalize_column_name(name):
+    """Strip a CSV header the way the loaders always have ("Nutrient Value" -> "NutrientValue")."""
+    return name.strip().replace(" ", "")
+
+
+def read_cnf_csv(table, data_dir=DATA_DIR, columns=None):
+    """
+    Read the CSV backing a CNF table, typed column-wise after the SQLAlchemy model.
+
+    Args:
+        table: SQLAlchemy ``Table`` (e.g. ``Food.__table__``) whose column types drive parsing.
+        data_dir (str): Folder holding the CNF CSVs.
+        columns (list): Model columns to read (default: all mapped columns).
+
+    Returns:
+        pd.DataFrame: One column per mapped model column. Integers are nullable ``Int64``,
+        floats ``float64``, dates ``datetime64`` (``NaT`` when missing or unparseable).
+    """
+    filename, col_map = CNF_CSV_FILES[table.name]
+    col_map = {k: v for k, v in col_map.items() if columns is None or k in columns}
+    wanted = set(col_map.values())
+    df = pd.read_csv(
+        os.path.join(data_dir, filename),
+        dtype=str,
+        encoding="latin1",
+        usecols=lambda c: normalize_column_name(c) in wanted,
+    )
+    df.columns = [normalize_column_name(c) for c in df.columns]
+    df = df.rename(columns={v: k for k, v in col_map.items()})[list(col_map)]
+
+    # Some CSVs (REFUSE NAME, YIELD NAME) are padded with ~1M rows of bare commas
+    df = df.dropna(how="all").reset_index(drop=True)
+
+    for name in df.columns:
+        column_type = table.columns[name].type
+        if isinstance(column_type, Integer):
+            df[name] = pd.to_numeric(df[name], errors="coerce").astype("Int64")
+        elif isinstance(column_type, Float):
+            df[name] = pd.to_numeric(df[name], errors="coerce").astype("float64")
+        elif isinstance(column_type, Date):
+            df[name] = pd.to_datetime(df[name], errors="coerce")
+    return df
+
+
+def snapshot_dir(data_dir=DATA_DIR):
+    return os.path.join(data_dir, SNAPSHOT_DIR_NAME)
+
+
+def snapshot_manifest(data_dir=DATA_DIR):
+    """The snapshot's manifest.json, or None when there is no snapshot."""
+    path = os.path.join(snapshot_dir(data_dir), "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def snapshot_is_current(data_dir=DATA_DIR):
+    """True when pyarrow is available and the snapshot was built from the CSVs as they are now."""
+    manifest = snapshot_manifest(data_dir)
+    return pa is not None and manifest is not None and manifest["version"] == data_version(data_dir)
+
+
+def build_snapshot(data_dir=DATA_DIR):
+    """
+    Write a typed, deduplicated Arrow IPC snapshot of every CNF table, stamped with ``data_version``.
+
+    Each table goes to ``<data_dir>/snapshot/<table>.arrow`` (uncompressed, so it can be
+    memory-mapped), written to a temporary file and renamed into place; manifest.json is
+    written last, so readers never see a half-built snapshot as current.
+    """
+    if pa is None:
+        raise ImportError("build_snapshot requires pyarrow (pip install pyarrow)")
+    try:
+        from microbe.cnf_api.cnf_sqlalchemy_postgres import Base
+    except ImportError:  # run as a script from microbe/cnf_api, like load_cnf_csv.py
+        from cnf_sqlalchemy_postgres import Base
+
+    out_dir = snapshot_dir(data_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    version = data_version(data_dir)
+    tables = {}
+    start = time.perf_counter()
+    for name in CNF_CSV_FILES:
+        df = read_cnf_csv(Base.metadata.tables[name], data_dir)
+        before = len(df)
+        df = df.drop_duplicates(subset=CNF_NATURAL_KEYS[name]).reset_index(drop=True)
+        arrow_table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(
+            {"cnf_version": version})
+        path = os.path.join(out_dir, f"{name}.arrow")
+        with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        os.replace(path + ".tmp", path)
+        tables[name] = {"rows": len(df), "duplicates_dropped": before - len(df)}
+        print(f"✅ {name}: {len(df):,} rows ({before - len(df):,} duplicates dropped)")
+
+    manifest = {"version": version, "created": datetime.now().isoformat(timespec="seconds"), "tables": tables}
+    with open(os.path.join(out_dir, "manifest.json.tmp"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(os.path.join(out_dir, "manifest.json.tmp"), os.path.join(out_dir, "manifest.json"))
+    print(f"✅ CNF snapshot {version} written to {out_dir} in {time.perf_counter() - start:.2f}s")
+    return manifest
+
+
+def read_snapshot_table(table_name, data_dir=DATA_DIR, columns=None):
+    """Memory-map one snapshot table as a ``pyarrow.Table`` (zero-copy; only ``columns`` are touched)."""
+    source = pa.memory_map(os.path.join(snapshot_dir(data_dir), f"{table_name}.arrow"), "r")
+    arrow_table = pa.ipc.open_file(source).read_all()
+    return arrow_table.select(columns) if columns is not None else arrow_table
+
+
+def read_cnf_table(table, data_dir=DATA_DIR, columns=None, prefer_snapshot=True):
+    """
+    Read a CNF table as a typed DataFrame, from the Arrow snapshot when it is current, else from the CSV.
+
+    Both sources give the same columns and dtypes (see ``read_cnf_csv``); the
+    snapshot additionally has duplicate natural keys removed.
+
+    Args:
+        table: SQLAlchemy ``Table`` (e.g. ``Food.__table__``).
+        data_dir (str): Folder holding the CNF CSVs.
+        columns (list): Model columns to read (default: all mapped columns).
+        prefer_snapshot (bool): Set to False to always parse the CSV.
+    """
+    if not (prefer_snapshot and snapshot_is_current(data_dir)):
+        return read_cnf_csv(table, data_dir, columns)
+    names = [c for c in CNF_CSV_FILES[table.name][1] if columns is None or c in columns]
+    df = read_snapshot_table(table.name, data_dir, names).to_pandas(
+        types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    for name in names:
+        if isinstance(table.columns[name].type, Date):
+            df[name] = df[name].astype("datetime64[ns]")
+    return df
+
+
+def to_records(df):
+    """Convert a typed CNF frame into DB-API friendly dicts (``None`` for nulls, ``date`` for dates)."""
+    out = df.astype(object)
+    for name in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[name]):
+            out[name] = df[name].dt.date.astype(object)
+    return out.where(df.notna(), None).to_dict("records")
+
+
+if __name__ == "__main__":
+    build_snapshot()
@@ -0,0 +1,228 @@
+# In-process, memory-resident view of the CNF for the nutrient calculator
+import re
+
+import numpy as np
+import pandas as pd
+
+from microbe.cnf_api.cnf_csv import DATA_DIR, data_version, read_cnf_table
+from microbe.cnf_api.cnf_sqlalchemy_postgres import Base
+from microbe.cnf_api.gram_weights import compute_gram_weights, flag_index
+
+# Columns describing each resolved recall item, ahead of the nutrient columns
+RECALL_COLUMNS = ["food", "quantity", "measure", "food_id", "description", "grams", "error"]
+
+
+def like_matcher(term):
+    """
+    Build a predicate reproducing ``LOWER(text) LIKE LOWER('%term%')``.
+
+    ``%`` and ``_`` inside ``term`` keep their SQL wildcard meaning, so the
+    memory engine matches exactly what the Postgres queries match.
+    """
+    term = term.lower()
+    if "%" not in term and "_" not in term:
+        return lambda text: term in text
+    pattern = re.compile("".join(
+        ".*" if c == "%" else "." if c == "_" else re.escape(c) for c in term), re.DOTALL)
+    return lambda text: pattern.search(text) is not None
+
+
+def _csr(rows, n_rows):
+    """Return (order, indptr) grouping ``rows`` by row index, keeping file order within a row."""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return order, indptr
+
+
+def _first_amount(food_rows, amounts, n_foods):
+    """Amount of the first row per food (``NaN`` when the food has none), like ``LIMIT 1``."""
+    first = np.full(n_foods, np.nan)
+    rows, idx = np.unique(food_rows, return_index=True)
+    known = rows >= 0
+    first[rows[known]] = amounts[idx[known]]
+    return first
+
+
+class CNFMemoryEngine:
+    """
+    Loads the CNF tables once into NumPy arrays indexed by food row.
+
+    Answers the same questions as the Postgres path of ``nutrient_calculator``
+    (food lookup, measure lookup, conversion, refuse, yield, nutrients) with the
+    same results, without a database server. Per-food nutrients and conversion
+    factors are stored in CSR layout: the entries of food row ``i`` are
+    ``indptr[i]:indptr[i + 1]``.
+
+    At load time every conversion row gets its edible gram weight for the four
+    refuse/yield combinations (``gram_weights``), and nutrients are spread into
+    a dense (foods x nutrients) matrix, so a nutrient query is one lookup and
+    one vector scale. ``version`` is the ``data_version`` the engine was built from.
+    """
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.version = data_version(data_dir)
+        tables = Base.metadata.tables
+        food = read_cnf_table(tables['food'], data_dir)
+        food_group = read_cnf_table(tables['food_group'], data_dir)
+        nutrient_name = read_cnf_table(tables['nutrient_name'], data_dir)
+        nutrient_amount = read_cnf_table(tables['nutrient_amount'], data_dir)
+        measure_name = read_cnf_table(tables['measure_name'], data_dir)
+        conversion = read_cnf_table(tables['conversion_factor'], data_dir)
+        refuse = read_cnf_table(tables['refuse_amount'], data_dir)
+        yields = read_cnf_table(tables['yield_amount'], data_dir)
+
+        # Foods, in table order so name lookups return the same first match as SQL
+        self.food_ids = food['food_id'].to_numpy(dtype=np.int64)
+        self.food_descriptions = food['description'].fillna("").tolist()
+        self.food_descriptions_fr = food['description_fr'].fillna("").tolist()
+        self._food_descriptions_lower = [d.lower() for d in self.food_descriptions]
+        self.food_group_ids = food['food_group_id'].to_numpy(dtype=np.int64, na_value=-1)
+        self.food_group_names = dict(zip(food_group['food_group_id'].astype(int), food_group['name'].fillna("")))
+        self._food_index = pd.Index(self.food_ids)
+        self._food_rows = {food_id: row for row, food_id in enumerate(self.food_ids.tolist())}
+        n_foods = len(self.food_ids)
+
+        # Nutrient names, kept as parallel object arrays
+        self.nutrient_ids = nutrient_name['nutrient_name_id'].to_numpy(dtype=np.int64)
+        self.nutrient_symbols = nutrient_name['symbol'].to_numpy(dtype=object)
+        self.nutrient_names = nutrient_name['name'].to_numpy(dtype=object)
+        self.nutrient_units = nutrient_name['unit'].to_numpy(dtype=object)
+        nutrient_index = pd.Index(self.nutrient_ids)
+
+        # Nutrients per 100 g (inner join on food and nutrient_name, as in SQL)
+        food_rows = self._food_index.get_indexer(nutrient_amount['food_id'])
+        nutrient_cols = nutrient_index.get_indexer(nutrient_amount['nutrient_name_id'])
+        keep = (food_rows >= 0) & (nutrient_cols >= 0)
+        food_rows, nutrient_cols = food_rows[keep], nutrient_cols[keep]
+        values = nutrient_amount['value'].to_numpy(dtype=np.float64, na_value=np.nan)[keep]
+        order, self.nutrient_indptr = _csr(food_rows, n_foods)
+        self.nutrient_cols = nutrient_cols[order].astype(np.int32)
+        self.nutrient_values = values[order]
+
+        # Conversion factors joined to measure names
+        measure_names = dict(zip(measure_name['measure_id'], measure_name['name'].fillna("")))
+        food_rows = self._food_index.get_indexer(conversion['food_id'])
+        has_measure = conversion['measure_id'].isin(measure_names).to_numpy()
+        keep = (food_rows >= 0) & has_measure
+        food_rows = food_rows[keep]
+        measure_ids = conversion['measure_id'].to_numpy(dtype=np.int64, na_value=0)[keep]
+        factors = conversion['value'].to_numpy(dtype=np.float64, na_value=np.nan)[keep]
+        order, self.conversion_indptr = _csr(food_rows, n_foods)
+        self.conversion_measure_ids = measure_ids[order]
+        self.conversion_values = factors[order]
+        self.measure_names = measure_names
+        self._measure_names_lower = {k: v.lower() for k, v in measure_names.items()}
+
+        # First refuse / yield percentage per food
+        self.refuse_percent = _first_amount(
+            self._food_index.get_indexer(refuse['food_id']),
+            refuse['amount'].to_numpy(dtype=np.float64, na_value=np.nan), n_foods)
+        self.yield_percent = _first_amount(
+            self._food_index.get_indexer(yields['food_id']),
+            yields['amount'].to_numpy(dtype=np.float64, na_value=np.nan), n_foods)
+
+        # Stable symbol order used when sorting results, as ``sort_values('symbol')`` does
+        self.nutrient_order = np.argsort(self.nutrient_symbols.astype(str), kind="stable")
+        self._symbol_rank = np.argsort(self.nutrient_order)
+
+        # Edible grams per unit of each conversion row, one column per refuse/yield combination
+        conversion_rows = np.repeat(np.arange(n_foods), np.diff(self.conversion_indptr))
+        self.gram_weights = compute_gram_weights(
+            self.conversion_values, self.refuse_percent[conversion_rows], self.yield_percent[conversion_rows])
+
+        # Dense nutrients per 100 g, columns in symbol order; nutrient_present marks the stored entries
+        nutrient_rows = np.repeat(np.arange(n_foods), np.diff(self.nutrient_indptr))
+        symbol_cols = self._symbol_rank[self.nutrient_cols]
+        self.nutrient_dense = np.full((n_foods, len(self.nutrient_ids)), np.nan)
+        self.nutrient_present = np.zeros((n_foods, len(self.nutrient_ids)), dtype=bool)
+        # Reversed so the first entry wins when a (food, nutrient) pair is repeated
+        self.nutrient_dense[nutrient_rows[::-1], symbol_cols[::-1]] = self.nutrient_values[::-1]
+        self.nutrient_present[nutrient_rows, symbol_cols] = True
+        self.nutrient_names_sorted = self.nutrient_names[self.nutrient_order]
+
+    def food_row(self, food_id):
+        row = self._food_rows.get(int(food_id))
+        if row is None:
+            raise ValueError(f"Food '{food_id}' not found.")
+        return row
+
+    def get_food_id_by_name(self, food_identifier):
+        if isinstance(food_identifier, (int, np.integer)) or (
+                isinstance(food_identifier, str) and food_identifier.isdigit()):
+            return int(food_identifier)
+        matches = like_matcher(food_identifier)
+        for row, description in enumerate(self._food_descriptions_lower):
+            if matches(description):
+                return int(self.food_ids[row])
+        raise ValueError(f"Food '{food_identifier}' not found.")
+
+    def find_conversion(self, food_id, measure_search_name):
+        """Return the conversion row of the first measure of the food matching the name."""
+        row = self.food_row(food_id)
+        matches = like_matcher(measure_search_name)
+        for i in range(self.conversion_indptr[row], self.conversion_indptr[row + 1]):
+            if matches(self._measure_names_lower[int(self.conversion_measure_ids[i])]):
+                return i
+        raise ValueError(f"Measure '{measure_search_name}' not found for food '{food_id}'.")
+
+    def gram_weight(self, food_id, measure_search_name, adjust_for_refuse=True, adjust_for_yield=True):
+        """Precomputed edible grams per unit of the first matching measure."""
+        i = self.find_conversion(food_id, measure_search_name)
+        return float(self.gram_weights[i, flag_index(adjust_for_refuse, adjust_for_yield)])
+
+    def calculate_nutrients(self, food_identifier, measure_search_name, quantity=1, adjust_for_refuse=True,
+                            adjust_for_yield=True, debug=False):
+        """Memory-resident equivalent of ``nutrient_calculator.calculate_nutrients``."""
+        food_id = self.get_food_id_by_name(food_identifier)
+        total_grams = self.gram_weight(food_id, measure_search_name, adjust_for_refuse, adjust_for_yield) * quantity
+        row = self.food_row(food_id)
+        present = self.nutrient_present[row]
+        if not present.any():
+            raise ValueError(f"No nutrient data found for FoodID '{food_id}'.")
+
+        amounts = self.nutrient_dense[row, present] * (total_grams / 100)
+        result = [[name, float(a)] for name, a in zip(self.nutrient_names_sorted[present], amounts)]
+        if debug:
+            return "\n".join(f"{name} {amount}" for name, amount in result)
+        return result
+
+    def nutrient_matrix(self, food_ids):
+        """
+        Dense (foods x nutrients) values per 100 g, rows taken from ``nutrient_dense``.
+
+        Columns follow ``nutrient_order`` (by symbol); nutrients a food lacks are ``NaN``.
+        """
+        rows = np.array([self.food_row(food_id) for food_id in food_ids], dtype=np.int64)
+        return self.nutrient_dense[rows]
+
+    def resolve_recall(self, items, adjust_for_refuse=True, adjust_for_yield=True):
+        """
+        Resolve (food_id, quantity, measure) items to foods and edible grams.
+
+        Food names are resolved to ids beforehand, through the food-name index, as for the SQL path.
+
+        Returns:
+            tuple: (resolved items DataFrame, nutrients per 100 g DataFrame indexed by food_id),
+            the same shapes ``nutrient_calculator.calculate_recall_nutrients`` gets from SQL.
+        """
+        records = []
+        for food, quantity, measure in items:
+            record = {"food": food, "quantity": quantity, "measure": measure,
+                      "food_id": None, "description": None, "grams": np.nan, "error": None}
+            try:
+                food_id = int(food)
+                grams = self.gram_weight(food_id, measure, adjust_for_refuse, adjust_for_yield) * quantity
+                record["food_id"] = food_id
+                record["description"] = self.food_descriptions[self.food_row(food_id)]
+                record["grams"] = grams
+            except ValueError as e:
+                record["error"] = str(e)
+            records.append(record)
+
+        resolved = pd.DataFrame(records, columns=RECALL_COLUMNS)
+        food_ids = list(dict.fromkeys(r["food_id"] for r in records if r["food_id"] is not None))
+        per_100g = pd.DataFrame(self.nutrient_matrix(food_ids), index=pd.Index(food_ids, name="food_id"),
+                                columns=self.nutrient_names_sorted)
+        return resolved, per_100g
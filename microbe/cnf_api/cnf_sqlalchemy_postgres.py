@@ -1,5 +1,5 @@
 # SQLAlchemy models for the Canadian Nutrient File (2015)
-from sqlalchemy import Column, Integer, Float, String, Date, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, Date, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -20,6 +20,10 @@ class Food(Base):
     food_group = relationship("FoodGroup")
     food_source = relationship("FoodSource")
 
+    __table_args__ = (
+        Index('ix_food_food_group_id', 'food_group_id'),
+    )
+
 class FoodGroup(Base):
     __tablename__ = 'food_group'
     food_group_id = Column(Integer, primary_key=True)
@@ -63,6 +67,14 @@ class NutrientAmount(Base):
     num_observations = Column(Integer)
     date_of_entry = Column(Date)
 
+    # One value per (food, nutrient); the key's index carries the value, so the
+    # per-food nutrient lookups can be answered from the index alone
+    __table_args__ = (
+        UniqueConstraint('food_id', 'nutrient_name_id', name='uq_nutrient_amount_food_nutrient',
+                         postgresql_include=['value']),
+        Index('ix_nutrient_amount_nutrient_name_id', 'nutrient_name_id'),
+    )
+
 class MeasureName(Base):
     __tablename__ = 'measure_name'
     measure_id = Column(Integer, primary_key=True)
@@ -77,6 +89,10 @@ class ConversionFactor(Base):
     value = Column(Float)
     date_of_entry = Column(Date)
 
+    __table_args__ = (
+        UniqueConstraint('food_id', 'measure_id', name='uq_conversion_factor_food_measure'),
+    )
+
 class RefuseName(Base):
     __tablename__ = 'refuse_name'
     refuse_id = Column(Integer, primary_key=True)
@@ -91,6 +107,10 @@ class RefuseAmount(Base):
     amount = Column(Float)
     date_of_entry = Column(Date)
 
+    __table_args__ = (
+        UniqueConstraint('food_id', 'refuse_id', name='uq_refuse_amount_food_refuse'),
+    )
+
 class YieldName(Base):
     __tablename__ = 'yield_name'
     yield_id = Column(Integer, primary_key=True)
@@ -104,3 +124,7 @@ class YieldAmount(Base):
     yield_id = Column(Integer, ForeignKey('yield_name.yield_id'))
     amount = Column(Float)
     date_of_entry = Column(Date)
+
+    __table_args__ = (
+        UniqueConstraint('food_id', 'yield_id', name='uq_yield_amount_food_yield'),
+    )
@@ -0,0 +1,163 @@
+# Ranked food-name search over the CNF English and French descriptions
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from microbe.cnf_api.cnf_csv import DATA_DIR, read_cnf_table
+from microbe.cnf_api.cnf_sqlalchemy_postgres import Base
+
+# Score weights: trigram similarity (|shared| / |union|), share of the query's
+# trigrams found in the description (like pg_trgm word_similarity), and share
+# of the query's words found whole in the description
+SIMILARITY_WEIGHT = 0.4
+COVERAGE_WEIGHT = 0.4
+TOKEN_WEIGHT = 0.2
+
+FOOD_SEARCH_SQL = """
+    SELECT "food_id", "description",
+           GREATEST(word_similarity(:query, "description"),
+                    word_similarity(:query, COALESCE("description_fr", ''))) AS score
+    FROM food
+    WHERE :query <% "description" OR :query <% "description_fr"
+    ORDER BY score DESC, similarity("description", :query) DESC, "food_id"
+    LIMIT :k
+"""
+
+# GIN trigram indexes, each on the exact expression its query filters on: the raw
+# descriptions for the "<%" of FOOD_SEARCH_SQL, and LOWER(name) for the measure
+# LIKE filters of the calculator queries
+TRGM_INDEXES = {
+    "ix_food_description_trgm": 'food USING gin ("description" gin_trgm_ops)',
+    "ix_food_description_fr_trgm": 'food USING gin ("description_fr" gin_trgm_ops)',
+    "ix_measure_name_name_lower_trgm": 'measure_name USING gin (LOWER("name") gin_trgm_ops)',
+}
+
+
+def normalize(value):
+    """Lowercase, strip accents and reduce punctuation to spaces ("Yogourt, à boire" -> "yogourt a boire")."""
+    value = unicodedata.normalize("NFKD", str(value)).encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.findall(r"[a-z0-9]+", value.lower()))
+
+
+def trigrams(value):
+    """pg_trgm-style trigrams: each word padded with two leading and one trailing space."""
+    grams = set()
+    for word in normalize(value).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _postings(doc_terms):
+    """CSR postings (vocabulary, indptr, docs) from one iterable of terms per document."""
+    vocabulary = {}
+    term_ids, doc_ids = [], []
+    for doc, terms in enumerate(doc_terms):
+        for term in terms:
+            term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            doc_ids.append(doc)
+    term_ids = np.asarray(term_ids, dtype=np.int64)
+    order = np.argsort(term_ids, kind="stable")
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=indptr[1:])
+    return vocabulary, indptr, np.asarray(doc_ids, dtype=np.int32)[order]
+
+
+class FoodNameIndex:
+    """
+    In-memory ranked search over food descriptions.
+
+    Combines a token inverted index (how many query words a description
+    contains) with trigram similarity and trigram coverage of the query, over
+    both the English and the French description. Each food scores the better
+    of its two descriptions.
+    """
+
+    def __init__(self, food_ids, descriptions, descriptions_fr=None):
+        self.food_ids = np.asarray(food_ids, dtype=np.int64)
+        self.descriptions = ["" if pd.isna(d) else str(d) for d in descriptions]
+        descriptions_fr = descriptions_fr if descriptions_fr is not None else [""] * len(self.descriptions)
+        # Document 2*i is food i in English, 2*i+1 in French
+        docs = [d for pair in zip(self.descriptions, descriptions_fr) for d in pair]
+
+        doc_trigrams = [trigrams(d) if not pd.isna(d) else set() for d in docs]
+        self._trigram_counts = np.array([len(t) for t in doc_trigrams], dtype=np.float64)
+        self._trigrams = _postings(doc_trigrams)
+        self._tokens = _postings(set(normalize(d).split()) if not pd.isna(d) else set() for d in docs)
+
+    @classmethod
+    def from_dataframe(cls, food_df):
+        return cls(food_df["food_id"], food_df["description"], food_df["description_fr"].tolist())
+
+    @classmethod
+    def from_csv(cls, data_dir=DATA_DIR):
+        return cls.from_dataframe(read_cnf_table(Base.metadata.tables['food'], data_dir))
+
+    @classmethod
+    def from_database(cls, engine):
+        with engine.connect() as conn:
+            food_df = pd.read_sql_query(
+                text('SELECT "food_id", "description", "description_fr" FROM food'), conn)
+        return cls.from_dataframe(food_df)
+
+    def _doc_hits(self, postings, terms):
+        vocabulary, indptr, docs = postings
+        ids = [vocabulary[t] for t in terms if t in vocabulary]
+        if not ids:
+            return np.zeros(2 * len(self.food_ids))
+        hits = np.concatenate([docs[indptr[i]:indptr[i + 1]] for i in ids])
+        return np.bincount(hits, minlength=2 * len(self.food_ids)).astype(np.float64)
+
+    def scores(self, query):
+        """Score of every food for ``query`` in [0, 1], aligned with ``food_ids``."""
+        query_trigrams = trigrams(query)
+        query_tokens = set(normalize(query).split())
+        if not query_trigrams:
+            return np.zeros(len(self.food_ids))
+
+        shared = self._doc_hits(self._trigrams, query_trigrams)
+        similarity = shared / (len(query_trigrams) + self._trigram_counts - shared)
+        coverage = shared / len(query_trigrams)
+        tokens = self._doc_hits(self._tokens, query_tokens) / len(query_tokens)
+        doc_scores = SIMILARITY_WEIGHT * similarity + COVERAGE_WEIGHT * coverage + TOKEN_WEIGHT * tokens
+        return doc_scores.reshape(-1, 2).max(axis=1)
+
+    def search(self, query, k=5, min_score=0.0):
+        """
+        Return the top-``k`` foods for ``query``.
+
+        Returns:
+            list: ``(food_id, description, score)`` tuples, best first; ties keep table order.
+        """
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(self.food_ids[i]), self.descriptions[i], float(scores[i]))
+                for i in top if scores[i] > min_score]
+
+
+def ensure_trgm_index(engine):
+    """
+    Create the pg_trgm extension and the ``TRGM_INDEXES``; safe to run repeatedly.
+
+    Returns:
+        list: Names of the trigram indexes.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for name, definition in TRGM_INDEXES.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}"))
+    return list(TRGM_INDEXES)
+
+
+def search_foods_database(engine, query, k=5):
+    """Ranked top-``k`` search through pg_trgm; uses the GIN indexes from ``ensure_trgm_index``."""
+    with engine.connect() as conn:
+        rows = conn.execute(text(FOOD_SEARCH_SQL), {"query": query, "k": k}).fetchall()
+    return [(int(food_id), description, float(score)) for food_id, description, score in rows]
@@ -0,0 +1,213 @@
+# Nearest-neighbour food substitutions over the CNF nutrient matrix
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from microbe.cnf_api.food_index import normalize
+
+# Nutrients compared by default and their weight in the distance (names as in nutrient_name)
+DEFAULT_NUTRIENT_WEIGHTS = {
+    "ENERGY (KILOCALORIES)": 3.0,
+    "PROTEIN": 2.0,
+    "FAT (TOTAL LIPIDS)": 2.0,
+    "CARBOHYDRATE, TOTAL (BY DIFFERENCE)": 2.0,
+    "FIBRE, TOTAL DIETARY": 1.0,
+    "SUGARS, TOTAL": 1.0,
+    "FATTY ACIDS, SATURATED, TOTAL": 1.0,
+    "SODIUM": 1.0,
+    "CALCIUM": 0.5,
+    "IRON": 0.5,
+    "POTASSIUM": 0.5,
+    "VITAMIN C": 0.5,
+}
+
+# The CNF has no live-microbe data, so foods are tagged from their description:
+# fermented foods usually eaten with live cultures, unless the description
+# points to a heat-treated or mixed product
+LIVE_MICROBE_TERMS = {"yogourt", "yogurt", "kefir", "sauerkraut", "kimchi", "miso", "tempeh", "natto",
+                      "kombucha", "cultured", "fermented", "cheese"}
+LIVE_MICROBE_EXCLUDED_TERMS = {"canned", "processed", "dressing", "sauce", "dip", "pizza", "sandwich", "cake",
+                               "pie", "dessert", "spread", "powder", "dry", "macaroni", "cheeseburger", "cheesecake"}
+
+# Candidates must have at least this share of the weighted nutrients the food has
+MIN_COVERAGE = 0.75
+
+# Energy-matched portions stay within these multiples of the original portion
+PORTION_RANGE = (0.25, 4.0)
+
+SUBSTITUTION_FOODS_SQL = """
+    SELECT f."food_id", f."description", f."food_group_id", g."name" AS "food_group"
+    FROM food f
+    LEFT JOIN food_group g ON g."food_group_id" = f."food_group_id"
+    ORDER BY f."food_id"
+"""
+
+SUBSTITUTION_NUTRIENTS_SQL = """
+    SELECT na."food_id", nn."name", na."value"
+    FROM nutrient_amount na
+    JOIN nutrient_name nn ON nn."nutrient_name_id" = na."nutrient_name_id"
+    WHERE nn."name" = ANY(:names)
+    ORDER BY na."id"
+"""
+
+
+def live_microbe_tags(descriptions):
+    """Boolean array marking descriptions of foods likely to carry live microbes (see ``LIVE_MICROBE_TERMS``)."""
+    tags = []
+    for description in descriptions:
+        words = set(normalize(description).split())
+        tags.append(bool(words & LIVE_MICROBE_TERMS) and not words & LIVE_MICROBE_EXCLUDED_TERMS)
+    return np.array(tags, dtype=bool)
+
+
+class SubstitutionIndex:
+    """
+    k-nearest foods to a food portion, by weighted distance between nutrient profiles.
+
+    Each weighted nutrient is divided by its 90th percentile over all foods, so
+    energy in kcal and sodium in mg weigh what their weights say. A query
+    scores every food at once: the candidate's portion is scaled to the same
+    energy as the original (or kept at the same weight), and the distance is
+    the weighted RMS difference of the scaled nutrients present in both foods.
+    Searching the ~5,700 CNF foods takes a few milliseconds, so no ANN index is needed.
+
+    Args:
+        food_ids (array): Food ids, one row each.
+        descriptions (list): Food descriptions.
+        food_group_ids (array): Food group of each food (-1 when unknown).
+        food_group_names (dict): ``{food_group_id: name}``.
+        nutrients (DataFrame): Values per 100 g, one row per food and one column per
+            nutrient name in ``weights``; ``NaN`` where the food has no value.
+        weights (dict): ``{nutrient name: weight}``.
+        live_microbes (array): Optional live-microbe tag per food; defaults to ``live_microbe_tags``.
+    """
+
+    def __init__(self, food_ids, descriptions, food_group_ids, food_group_names, nutrients,
+                 weights=DEFAULT_NUTRIENT_WEIGHTS, live_microbes=None):
+        self.food_ids = np.asarray(food_ids, dtype=np.int64)
+        self.descriptions = list(descriptions)
+        self.food_group_ids = np.asarray(food_group_ids, dtype=np.int64)
+        self.food_group_names = dict(food_group_names)
+        self.live_microbes = live_microbe_tags(self.descriptions) if live_microbes is None \
+            else np.asarray(live_microbes, dtype=bool)
+        self._food_rows = {food_id: row for row, food_id in enumerate(self.food_ids.tolist())}
+
+        self.nutrient_names = [name for name in weights if name in nutrients.columns]
+        self.weights = np.array([weights[name] for name in self.nutrient_names])
+        self.values = nutrients[self.nutrient_names].to_numpy(dtype=np.float64)
+        scale = np.nanpercentile(self.values, 90, axis=0)
+        self.scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+        self._normalized = self.values / self.scale
+        self._present = ~np.isnan(self.values)
+        self._energy = self.values[:, self.nutrient_names.index("ENERGY (KILOCALORIES)")] \
+            if "ENERGY (KILOCALORIES)" in self.nutrient_names else None
+
+    @classmethod
+    def from_memory_engine(cls, engine, weights=DEFAULT_NUTRIENT_WEIGHTS):
+        """Reuse the dense nutrient matrix of a ``CNFMemoryEngine``."""
+        nutrients = pd.DataFrame(engine.nutrient_dense, columns=engine.nutrient_names_sorted)
+        nutrients = nutrients.loc[:, ~nutrients.columns.duplicated()]
+        return cls(engine.food_ids, engine.food_descriptions, engine.food_group_ids, engine.food_group_names,
+                   nutrients, weights)
+
+    @classmethod
+    def from_database(cls, engine, weights=DEFAULT_NUTRIENT_WEIGHTS):
+        """Load the weighted nutrients of every food from ``nutrient_amount`` and ``nutrient_name``."""
+        with engine.connect() as conn:
+            foods = pd.read_sql_query(text(SUBSTITUTION_FOODS_SQL), conn)
+            amounts = pd.read_sql_query(text(SUBSTITUTION_NUTRIENTS_SQL), conn, params={"names": list(weights)})
+        # First value wins when a (food, nutrient) pair is repeated, as in the memory engine
+        amounts = amounts.drop_duplicates(["food_id", "name"])
+        nutrients = (amounts.pivot(index="food_id", columns="name", values="value")
+                     .reindex(index=foods["food_id"], columns=list(weights)).astype(float))
+        groups = foods.dropna(subset=["food_group_id"]).drop_duplicates("food_group_id")
+        return cls(foods["food_id"], foods["description"].fillna(""),
+                   foods["food_group_id"].fillna(-1), dict(zip(groups["food_group_id"].astype(int), groups["food_group"])),
+                   nutrients.reset_index(drop=True), weights)
+
+    def food_row(self, food_id):
+        row = self._food_rows.get(int(food_id))
+        if row is None:
+            raise ValueError(f"Food '{food_id}' not found.")
+        return row
+
+    def group_ids(self, food_groups):
+        """Food group ids matching ids or (case-insensitive, partial) names."""
+        ids = set()
+        for group in food_groups:
+            if isinstance(group, (int, np.integer)) or str(group).isdigit():
+                ids.add(int(group))
+            else:
+                ids.update(i for i, name in self.food_group_names.items() if str(group).lower() in str(name).lower())
+        return ids
+
+    def search(self, food_id, grams=100.0, k=5, food_groups=None, same_group=False, live_microbes=False,
+               match_energy=True, weights=None, min_coverage=MIN_COVERAGE):
+        """
+        The ``k`` foods whose portion comes closest to ``grams`` of ``food_id`` in nutrients.
+
+        Args:
+            food_id (int): Food to substitute.
+            grams (float): Portion of that food.
+            k (int): Substitutes returned.
+            food_groups (list): Only consider these food groups (ids or names).
+            same_group (bool): Only consider the food's own group.
+            live_microbes (bool): Only consider foods tagged as carrying live microbes.
+            match_energy (bool): Scale each candidate's portion to the food's energy;
+                otherwise compare at the same weight.
+            weights (dict): Per-nutrient weights overriding the index's (same nutrient names).
+            min_coverage (float): Minimum share of the food's weighted nutrients a candidate must have.
+
+        Returns:
+            DataFrame: One row per substitute, closest first (ties by food id): food_id, description, food_group,
+            live_microbes, grams, distance, then the weighted nutrients for that portion.
+        """
+        row = self.food_row(food_id)
+        w = self.weights if weights is None else np.array([weights.get(n, 0.0) for n in self.nutrient_names])
+        w = np.where(self._present[row], w, 0.0)
+        if not w.any():
+            raise ValueError(f"No nutrient data found for FoodID '{food_id}'.")
+
+        portions = np.full(len(self.food_ids), float(grams))
+        if match_energy and self._energy is not None and self._energy[row] > 0:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = self._energy[row] / self._energy
+            ratio = np.clip(np.where(np.isfinite(ratio) & (ratio > 0), ratio, 1.0), *PORTION_RANGE)
+            portions = portions * ratio
+
+        target = self._normalized[row] * grams / 100
+        candidates = self._normalized * (portions / 100)[:, None]
+        mask = self._present & (w > 0)
+        diff = np.where(mask, candidates - target, 0.0)
+        covered = mask @ w
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance = np.sqrt((diff * diff) @ w / covered)
+
+        keep = (covered >= min_coverage * w.sum()) & np.isfinite(distance)
+        keep[row] = False
+        if same_group:
+            keep &= self.food_group_ids == self.food_group_ids[row]
+        if food_groups:
+            keep &= np.isin(self.food_group_ids, list(self.group_ids(food_groups)))
+        if live_microbes:
+            keep &= self.live_microbes
+
+        rows = np.flatnonzero(keep)
+        k = min(k, len(rows))
+        if k:
+            # Everything tied with the k-th distance, so ties resolve by food id rather than partition order
+            kth = np.partition(distance[rows], k - 1)[k - 1]
+            top = rows[distance[rows] <= kth]
+            top = top[np.lexsort((self.food_ids[top], distance[top]))][:k]
+        else:
+            top = rows[:0]
+        result = pd.DataFrame({
+            "food_id": self.food_ids[top],
+            "description": [self.descriptions[i] for i in top],
+            "food_group": [self.food_group_names.get(int(g)) for g in self.food_group_ids[top]],
+            "live_microbes": self.live_microbes[top],
+            "grams": portions[top],
+            "distance": distance[top],
+        })
+        amounts = pd.DataFrame(self.values[top] * (portions[top] / 100)[:, None], columns=self.nutrient_names)
+        return pd.concat([result, amounts], axis=1)
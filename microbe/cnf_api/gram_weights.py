@@ -0,0 +1,83 @@
+# Edible gram weights per (food, measure), precomputed for every refuse/yield combination
+import numpy as np
+from sqlalchemy import text
+
+# Materialized table holding the weights in Postgres
+GRAM_WEIGHT_TABLE = "food_measure_weight"
+
+# Weight column for each (adjust_for_refuse, adjust_for_yield); the position is flag_index()
+GRAM_WEIGHT_COLUMNS = ["grams", "grams_refuse", "grams_yield", "grams_refuse_yield"]
+
+# One row per (food, measure): the first conversion factor and the first refuse / yield amount
+# of the food, as the LIMIT 1 lookups of calculate_nutrients picked them. conversion_id keeps
+# the conversion_factor row order, so "first matching measure" stays the same
+REFRESH_GRAM_WEIGHTS_SQL = f"""
+    DROP TABLE IF EXISTS {GRAM_WEIGHT_TABLE};
+    CREATE TABLE {GRAM_WEIGHT_TABLE} AS
+    WITH base AS (
+        SELECT DISTINCT ON (cf."food_id", cf."measure_id")
+               cf."food_id", cf."measure_id", cf."id" AS conversion_id,
+               CASE WHEN cf."value" IS NULL OR cf."value" = 0 THEN 100 ELSE cf."value" * 100 END AS grams
+        FROM conversion_factor cf
+        ORDER BY cf."food_id", cf."measure_id", cf."id"
+    )
+    SELECT b."food_id", b."measure_id", b.conversion_id,
+           b.grams AS grams,
+           b.grams * COALESCE((100 - r."amount") / 100, 1) AS grams_refuse,
+           b.grams * COALESCE(y."amount" / 100, 1) AS grams_yield,
+           b.grams * COALESCE((100 - r."amount") / 100, 1) * COALESCE(y."amount" / 100, 1) AS grams_refuse_yield
+    FROM base b
+    LEFT JOIN LATERAL (
+        SELECT "amount" FROM refuse_amount WHERE "food_id" = b."food_id" ORDER BY "id" LIMIT 1) r ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT "amount" FROM yield_amount WHERE "food_id" = b."food_id" ORDER BY "id" LIMIT 1) y ON TRUE;
+    ALTER TABLE {GRAM_WEIGHT_TABLE} ADD PRIMARY KEY ("food_id", "measure_id");
+"""
+
+
+def flag_index(adjust_for_refuse=True, adjust_for_yield=True):
+    """Column of ``GRAM_WEIGHT_COLUMNS`` for a refuse/yield flag combination."""
+    return int(bool(adjust_for_refuse)) | int(bool(adjust_for_yield)) << 1
+
+
+def compute_gram_weights(conversion_values, refuse_percent, yield_percent):
+    """
+    Edible grams per unit of each measure, for the four refuse/yield combinations.
+
+    Args:
+        conversion_values: Conversion factor of each (food, measure) row (``NaN`` when missing).
+        refuse_percent: Refuse percentage of the row's food (``NaN`` when it has none).
+        yield_percent: Yield percentage of the row's food (``NaN`` when it has none).
+
+    Returns:
+        np.ndarray: ``(rows, 4)`` weights, columns as in ``GRAM_WEIGHT_COLUMNS``. A missing
+        or zero conversion factor counts as 100 g per unit, as in ``calculate_nutrients``.
+    """
+    grams = np.asarray(conversion_values, dtype=np.float64) * 100
+    grams = np.where(np.isnan(grams) | (grams == 0), 100.0, grams)
+    refuse = np.nan_to_num((100 - np.asarray(refuse_percent, dtype=np.float64)) / 100, nan=1.0)
+    yields = np.nan_to_num(np.asarray(yield_percent, dtype=np.float64) / 100, nan=1.0)
+    return np.column_stack([grams, grams * refuse, grams * yields, grams * refuse * yields])
+
+
+def refresh_gram_weights(engine):
+    """(Re)build the ``food_measure_weight`` table from the loaded CNF tables."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(REFRESH_GRAM_WEIGHTS_SQL)
+        rows = conn.execute(text(f"SELECT COUNT(*) FROM {GRAM_WEIGHT_TABLE}")).scalar()
+    print(f"✅ {GRAM_WEIGHT_TABLE}: {rows:,} (food, measure) gram weights")
+    return rows
+
+
+def gram_weights_exist(engine):
+    """Whether the ``food_measure_weight`` table exists."""
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT to_regclass(:name)"), {"name": GRAM_WEIGHT_TABLE}).scalar() is not None
+
+
+def ensure_gram_weights(engine):
+    """Build the ``food_measure_weight`` table if it doesn't exist yet; True when it was built."""
+    if gram_weights_exist(engine):
+        return False
+    refresh_gram_weights(engine)
+    return True
@@ -1,8 +1,25 @@
 # File: nutrient_calculator.py
 
-from sqlalchemy import create_engine, text
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
+import numpy as np
 import pandas as pd
 
+from microbe import tracing
+from microbe.cnf_api.cnf_csv import DATA_DIR, data_version
+from microbe.cnf_api.cnf_memory import RECALL_COLUMNS, CNFMemoryEngine
+from microbe.cnf_api.food_index import FoodNameIndex, ensure_trgm_index, search_foods_database
+from microbe.cnf_api.food_substitution import SubstitutionIndex
+from microbe.cnf_api.gram_weights import GRAM_WEIGHT_COLUMNS, GRAM_WEIGHT_TABLE, flag_index, gram_weights_exist
+
+logger = logging.getLogger(__name__)
+
 # Database connection settings
 DB_PARAMS = {
     "host": "localhost",
@@ -12,11 +29,125 @@ DB_PARAMS = {
     "port": 5432
 }
 
+# Pool settings for the process-wide engine (see ConnectionManager)
+POOL_PARAMS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+    "pool_pre_ping": False,
+}
+
+# Seconds between explicit health checks of the pooled engine
+HEALTH_CHECK_INTERVAL = 60
+
+# Food-name search: "index" (in-process FoodNameIndex) or "pg_trgm" (Postgres GIN trigram index)
+FOOD_SEARCH_BACKEND = "index"
+
+# Best-match score below which a food name counts as not found, for the FoodNameIndex score
+MIN_FOOD_MATCH_SCORE = 0.3
+
+# Same for the pg_trgm backend, whose score is word_similarity; "<%" already drops
+# matches below pg_trgm.word_similarity_threshold, 0.6 by default
+MIN_TRGM_MATCH_SCORE = 0.6
+
+# Seconds between checks that the CSVs behind the memory engine are unchanged
+DATA_VERSION_CHECK_INTERVAL = 5
+
+# Optional in-process engine; when set, lookups are answered from memory instead of Postgres
+_memory_engine = None
+_memory_engine_checked = 0.0
+_memory_engine_lock = threading.Lock()
+
+# Whether the food_measure_weight table is known to exist in Postgres
+_gram_weights_ready = False
+
+# Whether the pg_trgm extension and trigram indexes are known to exist in Postgres
+_trgm_ready = False
+_trgm_lock = threading.Lock()
+
+# Food-name index, built once from whichever backend is active
+_food_name_index = None
+_food_name_index_lock = threading.Lock()
+
+# Nutrient-distance index for substitutions, built once from whichever backend is active
+_substitution_index = None
+_substitution_index_lock = threading.Lock()
+
+# Substitutes listed by food_substitution_tool
+SUBSTITUTION_COUNT = 5
+
+
+def use_memory_engine(data_dir=None):
+    """Serve calculator lookups from the CNF CSVs held in memory, with no database server."""
+    global _memory_engine, _food_name_index, _substitution_index
+    _memory_engine = CNFMemoryEngine(data_dir) if data_dir else CNFMemoryEngine()
+    _food_name_index = None
+    _substitution_index = None
+    return _memory_engine
+
+
+def use_database():
+    """Serve calculator lookups from Postgres again (the default)."""
+    global _memory_engine, _food_name_index, _substitution_index
+    _memory_engine = None
+    _food_name_index = None
+    _substitution_index = None
+
+
+def refresh_memory_engine():
+    """Rebuild the memory engine (and food-name index) when its CSVs changed, e.g. after update_cnf."""
+    global _memory_engine, _memory_engine_checked, _food_name_index, _substitution_index
+    if _memory_engine is None or time.monotonic() - _memory_engine_checked < DATA_VERSION_CHECK_INTERVAL:
+        return _memory_engine
+    with _memory_engine_lock:
+        _memory_engine_checked = time.monotonic()
+        if _memory_engine is not None and data_version(_memory_engine.data_dir) != _memory_engine.version:
+            logger.info("🔄 CNF data changed, reloading %s", _memory_engine.data_dir)
+            _memory_engine = CNFMemoryEngine(_memory_engine.data_dir)
+            _food_name_index = None
+            _substitution_index = None
+    return _memory_engine
+
+
+def _check_gram_weights(engine):
+    """Fail clearly on first use of the SQL path when the materialized gram-weight table is missing."""
+    global _gram_weights_ready
+    if not _gram_weights_ready:
+        if not gram_weights_exist(engine):
+            raise RuntimeError(f"The {GRAM_WEIGHT_TABLE} table is missing; build it by loading the CNF CSVs "
+                               "(load_cnf_csv) or with python -m microbe.cnf_api.cnf_migrations")
+        _gram_weights_ready = True
+
+
+def _ensure_trgm_index(engine):
+    """Create the pg_trgm extension and indexes on the first pg_trgm search."""
+    global _trgm_ready
+    with _trgm_lock:
+        if not _trgm_ready:
+            try:
+                ensure_trgm_index(engine.engine)
+            except SQLAlchemyError as e:
+                raise RuntimeError("The pg_trgm food search needs the pg_trgm extension and indexes; run "
+                                   "python -m microbe.cnf_api.cnf_migrations --trigram as a database owner") from e
+            _trgm_ready = True
 
-def create_engine_from_params():
+
+def min_food_match_score():
+    """Best-match score a food name needs with the active search backend."""
+    return MIN_TRGM_MATCH_SCORE if FOOD_SEARCH_BACKEND == "pg_trgm" and _memory_engine is None \
+        else MIN_FOOD_MATCH_SCORE
+
+
+def cnf_data_version():
+    """Version of the CNF data behind the calculator; tool caches key their entries on it."""
+    return data_version(_memory_engine.data_dir if _memory_engine is not None else DATA_DIR)
+
+
+def create_engine_from_params(**engine_kwargs):
     """Create a SQLAlchemy engine from DB params."""
     url = f"postgresql+psycopg2://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['database']}"
-    return create_engine(url)
+    return create_engine(url, **engine_kwargs)
 
 
 def check_database_connection(engine):
@@ -28,33 +159,184 @@ def check_database_connection(engine):
         raise ConnectionError(f"Cannot connect to database: {e}")
 
 
+class ConnectionManager:
+    """
+    Process-wide, lazily created pooled engine for the calculator.
+
+    Exposes ``connect()`` like an ``Engine`` so it can be passed wherever one is
+    expected. Health checks run at most once per ``health_check_interval``
+    seconds instead of on every request, and pool activity is counted:
+
+    - ``connects``: new DBAPI connections opened (TCP + auth)
+    - ``checkouts``: connections handed out by the pool
+    - ``waits`` / ``wait_seconds``: checkouts requested while the pool was exhausted
+    - ``health_checks``: explicit ``SELECT 1`` probes
+    """
+
+    def __init__(self, pool_params=None, health_check_interval=HEALTH_CHECK_INTERVAL, engine_factory=None):
+        self.pool_params = dict(POOL_PARAMS if pool_params is None else pool_params)
+        self.health_check_interval = health_check_interval
+        self.engine_factory = engine_factory or create_engine_from_params
+        self._engine = None
+        self._last_health_check = None
+        self._lock = threading.Lock()
+        self._health_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"connects": 0, "checkouts": 0, "waits": 0, "wait_seconds": 0.0, "health_checks": 0}
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    engine = self.engine_factory(**self.pool_params)
+                    event.listen(engine, "connect", lambda *args: self._count("connects"))
+                    event.listen(engine, "checkout", lambda *args: self._count("checkouts"))
+                    self._engine = engine
+        return self._engine
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _pool_exhausted(self):
+        pool = self.engine.pool
+        max_overflow = self.pool_params.get("max_overflow", 10)
+        if not hasattr(pool, "size") or max_overflow < 0:
+            return False
+        return pool.checkedin() == 0 and pool.checkedout() >= pool.size() + max_overflow
+
+    @contextmanager
+    def connect(self):
+        exhausted = self._pool_exhausted()
+        start = time.perf_counter()
+        with self.engine.connect() as conn:
+            if exhausted:
+                self._count("waits")
+                self._count("wait_seconds", time.perf_counter() - start)
+            yield conn
+
+    def ensure_healthy(self):
+        """Probe the database if the last successful check is older than the interval."""
+        now = time.monotonic()
+        if self._last_health_check is not None and now - self._last_health_check < self.health_check_interval:
+            return
+        # Another thread is already probing; don't stack probes behind it
+        if not self._health_lock.acquire(blocking=False):
+            return
+        try:
+            self._count("health_checks")
+            try:
+                check_database_connection(self)
+            except ConnectionError:
+                self.dispose()
+                raise
+            self._last_health_check = now
+        finally:
+            self._health_lock.release()
+
+    def dispose(self):
+        """Close all pooled connections; the next request opens fresh ones."""
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose()
+            self._engine = None
+            self._last_health_check = None
+
+
+_connection_manager = None
+_connection_manager_lock = threading.Lock()
+
+
+def get_connection_manager():
+    """Return the process-wide ConnectionManager, creating it on first use."""
+    global _connection_manager
+    if _connection_manager is None:
+        with _connection_manager_lock:
+            if _connection_manager is None:
+                _connection_manager = ConnectionManager()
+    _connection_manager.ensure_healthy()
+    return _connection_manager
+
+
 def get_dataframe(engine, query, params=None):
     """Utility to run a query and return as pandas DataFrame."""
-    with engine.connect() as conn:
-        return pd.read_sql_query(text(query), conn, params=params)
-
-def get_food_id_by_name(food_identifier):
+    with tracing.span("db.query") as span, engine.connect() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params)
+        span.set(rows=len(df))
+        return df
+
+def get_food_name_index():
+    """Return the FoodNameIndex for the active backend, building it on first use."""
+    global _food_name_index
+    with _food_name_index_lock:
+        if _food_name_index is None:
+            if _memory_engine is not None:
+                _food_name_index = FoodNameIndex(
+                    _memory_engine.food_ids, _memory_engine.food_descriptions, _memory_engine.food_descriptions_fr)
+            else:
+                _food_name_index = FoodNameIndex.from_database(get_connection_manager())
+        return _food_name_index
+
+
+def get_substitution_index():
+    """Return the SubstitutionIndex for the active backend, building it on first use."""
+    global _substitution_index
+    with _substitution_index_lock:
+        if _substitution_index is None:
+            if _memory_engine is not None:
+                _substitution_index = SubstitutionIndex.from_memory_engine(_memory_engine)
+            else:
+                _substitution_index = SubstitutionIndex.from_database(get_connection_manager())
+        return _substitution_index
+
+
+@tracing.traced("cnf.search_foods")
+def search_foods(query, k=5):
+    """Ranked candidate foods for a name, as ``(food_id, description, score)`` tuples."""
+    refresh_memory_engine()
+    if FOOD_SEARCH_BACKEND == "pg_trgm" and _memory_engine is None:
+        engine = get_connection_manager()
+        _ensure_trgm_index(engine)
+        return search_foods_database(engine, query, k)
+    return get_food_name_index().search(query, k)
 
-    engine = create_engine_from_params()
-    check_database_connection(engine)
 
+def get_food_id_by_name(food_identifier):
     if isinstance(food_identifier, int) or (isinstance(food_identifier, str) and food_identifier.isdigit()):
-        food_id = int(food_identifier)
-    else:
-        # 1a. Search by name
-        food_query = """
-                SELECT "food_id", "description"
-                FROM food
-                WHERE LOWER("description") LIKE LOWER(:food)
-                LIMIT 1
-            """
-        food_df = get_dataframe(engine, food_query, params={"food": f"%{food_identifier}%"})
-        if food_df.empty:
-            raise ValueError(f"Food '{food_identifier}' not found.")
-        food_id = int(food_df.iloc[0]['food_id'])
-
-    return food_id
-
+        return int(food_identifier)
+
+    # 1a. Best-ranked match by name
+    matches = search_foods(food_identifier, k=1)
+    if not matches or matches[0][2] < min_food_match_score():
+        raise ValueError(f"Food '{food_identifier}' not found.")
+    return matches[0][0]
+
+
+# Measure of a food with its precomputed edible gram weight (refuse/yield folded in at load time);
+# "{weight_column}" is the GRAM_WEIGHT_COLUMNS entry for the refuse/yield flags
+MEASURE_QUERY = f"""
+    SELECT w."measure_id", mn."name", w."grams", w."{{weight_column}}" AS edible_grams
+    FROM {GRAM_WEIGHT_TABLE} w
+    JOIN measure_name mn ON w."measure_id" = mn."measure_id"
+    WHERE w."food_id" = :food_id
+      AND LOWER(mn."name") LIKE :measure
+    ORDER BY w."conversion_id"
+    LIMIT 1
+"""
+
+# Nutrients per 100g of a food
+NUTRIENTS_QUERY = """
+    SELECT na."value", nn."symbol", nn."name", nn."unit"
+    FROM nutrient_amount na
+    JOIN nutrient_name nn ON na."nutrient_name_id" = nn."nutrient_name_id"
+    WHERE na."food_id" = :food_id
+"""
+
+
+@tracing.traced("cnf.calculate_nutrients")
 def calculate_nutrients(food_identifier, measure_search_name, quantity=1, adjust_for_refuse=True, adjust_for_yield=True, debug=False):
     """
     Calculate nutrient breakdown for a given food and measure.
@@ -68,20 +350,17 @@ def calculate_nutrients(food_identifier, measure_search_name, quantity=1, adjust
         pd.DataFrame: Nutrient breakdown with scaled amounts
         :param adjust_for_refuse_and_yield:
     """
-    engine = create_engine_from_params()
-    check_database_connection(engine)
+    if refresh_memory_engine() is not None:
+        return _memory_engine.calculate_nutrients(
+            get_food_id_by_name(food_identifier), measure_search_name, quantity, adjust_for_refuse, adjust_for_yield, debug)
+
+    engine = get_connection_manager()
+    _check_gram_weights(engine)
 
     food_id=get_food_id_by_name(food_identifier)
 
-    # 2. Find MeasureID
-    measure_query = """
-           SELECT mn."measure_id", mn."name"
-           FROM conversion_factor cf
-           JOIN measure_name mn ON cf."measure_id" = mn."measure_id"
-           WHERE cf."food_id" = :food_id
-             AND LOWER(mn."name") LIKE :measure
-           LIMIT 1
-       """
+    # 2. Find MeasureID and its precomputed edible gram weight (refuse/yield folded in at load time)
+    measure_query = MEASURE_QUERY.format(weight_column=GRAM_WEIGHT_COLUMNS[flag_index(adjust_for_refuse, adjust_for_yield)])
     measure_df = get_dataframe(engine, measure_query,
                                params={"food_id": food_id, "measure": f"%{measure_search_name.lower()}%"})
 
@@ -90,64 +369,12 @@ def calculate_nutrients(food_identifier, measure_search_name, quantity=1, adjust
         raise ValueError(f"Measure '{measure_search_name}' not found for food '{food_id}'.")
     measure_id = int(measure_df.iloc[0]['measure_id'])
 
-    # 3. Find Conversion Factor
-    conversion_query = """
-        SELECT "value"
-        FROM conversion_factor
-        WHERE "food_id" = :food_id AND "measure_id" = :measure_id
-        LIMIT 1
-    """
-    conv_df = get_dataframe(engine, conversion_query, params={"food_id": food_id, "measure_id": measure_id})
-    if conv_df.empty:
-        raise ValueError(f"No conversion factor found for MeasureID '{measure_id}'.")
-    gram_weight = float(conv_df.iloc[0]['value']) * 100
-    total_grams = gram_weight * quantity
-
-    # ⚡ If Gm_Wgt is NaN or missing, fallback to 100g
-    if pd.isna(total_grams) or total_grams == 0:
-        print(f"⚠️ No Gm_Wgt found for this measure, assuming 100g per unit.")
-        total_grams = 100 * quantity
-
-    if adjust_for_refuse:
-        # Get refuse percent (if exists)
-        refuse_query = """
-                    SELECT "amount"
-                    FROM "refuse_amount"
-                    WHERE "food_id" = :food_id
-                    LIMIT 1
-                """
-        refuse_df = get_dataframe(engine, refuse_query, params={"food_id": food_id})
-
-        if not refuse_df.empty and refuse_df.iloc[0]['amount'] is not None:
-            refuse_percent = refuse_df.iloc[0]['amount']
-            print(f"Refuse amount found: {refuse_percent}%")
-            total_grams *= (100 - refuse_percent) / 100
-            print(f"Adjusted grams after refuse: {total_grams:.2f}g")
-
-    if adjust_for_yield:
-        # Get yield percent (if exists)
-        yield_query = """
-                    SELECT "amount"
-                    FROM "yield_amount"
-                    WHERE "food_id" = :food_id
-                    LIMIT 1
-                """
-        yield_df = get_dataframe(engine, yield_query, params={"food_id": food_id})
-
-        if not yield_df.empty and yield_df.iloc[0]['amount'] is not None:
-            yield_percent = yield_df.iloc[0]['amount']
-            print(f"Yield amount found: {yield_percent}%")
-            total_grams *= yield_percent / 100
-            print(f"Adjusted grams after yield: {total_grams:.2f}g")
+    # 3. Scale the per-unit weights by the quantity
+    gram_weight = float(measure_df.iloc[0]['grams'])
+    total_grams = float(measure_df.iloc[0]['edible_grams']) * quantity
 
     # 4. Find Nutrients per 100g
-    nutrients_query = """
-        SELECT na."value", nn."symbol", nn."name", nn."unit"
-        FROM nutrient_amount na
-        JOIN nutrient_name nn ON na."nutrient_name_id" = nn."nutrient_name_id"
-        WHERE na."food_id" = :food_id
-    """
-    nutrients_df = get_dataframe(engine, nutrients_query, params={"food_id": food_id})
+    nutrients_df = get_dataframe(engine, NUTRIENTS_QUERY, params={"food_id": food_id})
 
     if nutrients_df.empty:
         raise ValueError(f"No nutrient data found for FoodID '{food_id}'.")
@@ -156,10 +383,10 @@ def calculate_nutrients(food_identifier, measure_search_name, quantity=1, adjust
     nutrients_df['AmountPerMeasure'] = nutrients_df['value'].astype(float) * (total_grams / 100)
 
     # Inside the try block
-    print(f"🔎 Food: {food_identifier} (ID: {food_id})")
-    print(f"🔎 Measure requested: {measure_search_name} ➔ Measure ID: {measure_id}")
-    print(f"🔎 Base grams (before refuse/yield adjustment): {gram_weight:.2f}g")
-    print(f"🔎 Final grams (after refuse/yield adjustment): {total_grams:.2f}g")
+    logger.debug("🔎 Food: %s (ID: %s)", food_identifier, food_id)
+    logger.debug("🔎 Measure requested: %s ➔ Measure ID: %s", measure_search_name, measure_id)
+    logger.debug("🔎 Base grams (before refuse/yield adjustment): %.2fg", gram_weight * quantity)
+    logger.debug("🔎 Final grams (after refuse/yield adjustment): %.2fg", total_grams)
 
     # 6. Return result
     result = nutrients_df[['symbol', 'name', 'AmountPerMeasure', 'unit']].sort_values('symbol')
@@ -169,14 +396,127 @@ def calculate_nutrients(food_identifier, measure_search_name, quantity=1, adjust
     else:
         return dict
 
+# Default measure for recall items given in grams; its conversion factor is 1.0 (100 g)
+GRAMS_MEASURE = "100g"
+
+# Nutrients shown per item by recall_nutrient_calculator_tool
+RECALL_SUMMARY_NUTRIENTS = [
+    "ENERGY (KILOCALORIES)", "PROTEIN", "FAT (TOTAL LIPIDS)", "CARBOHYDRATE, TOTAL (BY DIFFERENCE)",
+    "FIBRE, TOTAL DIETARY", "SUGARS, TOTAL", "SODIUM",
+]
+
+# Foods arrive as ids, already resolved by name through the food-name index (as for the memory engine)
+RECALL_RESOLVE_QUERY = """
+    SELECT t.ord, f."food_id", f."description", w."grams", w."grams_refuse", w."grams_yield", w."grams_refuse_yield"
+    FROM unnest(CAST(:food_ids AS integer[]), CAST(:measures AS text[])) WITH ORDINALITY AS t(food_id, measure, ord)
+    LEFT JOIN food f ON f."food_id" = t.food_id
+    LEFT JOIN LATERAL (
+        SELECT w.*
+        FROM food_measure_weight w
+        JOIN measure_name mn ON w."measure_id" = mn."measure_id"
+        WHERE w."food_id" = f."food_id"
+          AND LOWER(mn."name") LIKE '%' || LOWER(t.measure) || '%'
+        ORDER BY w."conversion_id"
+        LIMIT 1
+    ) w ON TRUE
+    ORDER BY t.ord
+"""
+
+RECALL_NUTRIENTS_QUERY = """
+    SELECT na."food_id", na."value", nn."symbol", nn."name"
+    FROM nutrient_name nn
+    LEFT JOIN nutrient_amount na
+      ON na."nutrient_name_id" = nn."nutrient_name_id" AND na."food_id" = ANY(:food_ids)
+"""
+
+
+def _resolve_recall_sql(items, adjust_for_refuse=True, adjust_for_yield=True):
+    """Resolve ``(food_id, quantity, measure)`` items with one set-based lookup query plus one nutrient query."""
+    engine = get_connection_manager()
+    _check_gram_weights(engine)
+    lookup = get_dataframe(engine, RECALL_RESOLVE_QUERY, params={
+        "food_ids": [int(food_id) for food_id, _, _ in items],
+        "measures": [measure for _, _, measure in items],
+    })
+
+    quantity = np.array([q for _, q, _ in items], dtype=float)
+    weights = lookup[GRAM_WEIGHT_COLUMNS[flag_index(adjust_for_refuse, adjust_for_yield)]]
+    grams = weights.to_numpy(dtype=float, na_value=np.nan) * quantity
+
+    records = []
+    for (food, q, measure), row, g in zip(items, lookup.itertuples(index=False), grams):
+        record = {"food": food, "quantity": q, "measure": measure,
+                  "food_id": None, "description": None, "grams": np.nan, "error": None}
+        if pd.isna(row.food_id):
+            record["error"] = f"Food '{food}' not found."
+        elif pd.isna(row.grams):
+            record["error"] = f"Measure '{measure}' not found for food '{int(row.food_id)}'."
+        else:
+            record.update(food_id=int(row.food_id), description=row.description, grams=float(g))
+        records.append(record)
+    resolved = pd.DataFrame(records, columns=RECALL_COLUMNS)
+
+    food_ids = [int(f) for f in resolved["food_id"].dropna().unique()]
+    nutrients_df = get_dataframe(engine, RECALL_NUTRIENTS_QUERY, params={"food_ids": food_ids})
+    # Every nutrient is a column, so the matrix has the same shape whichever foods are asked for
+    columns = nutrients_df.drop_duplicates("name").sort_values("symbol", kind="stable")["name"]
+    per_100g = (nutrients_df.dropna(subset=["food_id"]).astype({"food_id": int, "value": float})
+                .pivot_table(index="food_id", columns="name", values="value", aggfunc="first", dropna=False)
+                .reindex(index=pd.Index(food_ids, name="food_id"), columns=columns))
+    return resolved, per_100g
+
+
+@tracing.traced("cnf.calculate_recall_nutrients")
+def calculate_recall_nutrients(items, adjust_for_refuse=True, adjust_for_yield=True):
+    """
+    Calculate nutrients for a whole dietary recall at once.
+
+    All foods and measures are resolved in one set-based query (or one array
+    gather on the memory engine) instead of one SQL sequence per item.
+
+    Args:
+        items (list): ``(food, quantity)`` or ``(food, quantity, measure)`` tuples;
+            ``measure`` defaults to ``GRAMS_MEASURE``, so ``quantity`` counts 100 g units.
+
+    Returns:
+        tuple: (items, totals). ``items`` is a DataFrame with one row per recall item
+        (food, quantity, measure, food_id, description, grams, error) followed by one
+        column per nutrient; ``totals`` is a Series of day totals per nutrient.
+        Items that cannot be resolved keep their ``error`` and contribute nothing.
+    """
+    items = [(food, float(quantity), measure[0] if measure else GRAMS_MEASURE)
+             for food, quantity, *measure in items]
+
+    # Names go through the food-name index; the backends only see food ids
+    food_ids = {}
+    for i, (food, _, _) in enumerate(items):
+        try:
+            food_ids[i] = get_food_id_by_name(food)
+        except ValueError:
+            pass
+    found = [(food_ids[i], quantity, measure) for i, (_, quantity, measure) in enumerate(items) if i in food_ids]
+    if refresh_memory_engine() is not None:
+        resolved, per_100g = _memory_engine.resolve_recall(found, adjust_for_refuse, adjust_for_yield)
+    else:
+        resolved, per_100g = _resolve_recall_sql(found, adjust_for_refuse, adjust_for_yield)
+
+    resolved = resolved.set_axis(list(food_ids)).reindex(range(len(items)))
+    resolved[["food", "quantity", "measure"]] = pd.DataFrame(items, columns=["food", "quantity", "measure"])
+    resolved["error"] = [resolved["error"][i] if i in food_ids else f"Food '{food}' not found."
+                         for i, (food, _, _) in enumerate(items)]
+
+    scaled = per_100g.reindex(resolved["food_id"]).to_numpy() * (resolved["grams"].to_numpy()[:, None] / 100)
+    matrix = pd.DataFrame(scaled, columns=per_100g.columns, index=resolved.index)
+    return pd.concat([resolved, matrix], axis=1), matrix.sum(axis=0, min_count=1)
+
+
 def filter_foods_in_cnf_node(state):
     valid_foods = []
     for food in state["selected_foods"]:
-        try:
-            _ = get_food_id_by_name(food)
-            valid_foods.append(food)
-        except ValueError:
-            continue
+        matches = search_foods(food, k=1)
+        if matches and matches[0][2] >= min_food_match_score():
+            # Keep the CNF description so later lookups hit the same food
+            valid_foods.append(matches[0][1])
     return {**state, "valid_substitutions": valid_foods}
 
 def calculate_nutrient_summary_node(state):
@@ -221,19 +561,23 @@ if __name__ == "__main__":
 
         print(f"❌ Unexpected error: {e}")
 
+def parse_food_grams(item_str):
+    """Split a "food | grams" item ("Butter, regular | 9.46g"; "food: grams" also accepted)."""
+    food, grams_str = item_str.split("|") if "|" in item_str else item_str.rsplit(":", 1)
+    return food.strip(), float(grams_str.strip().lower().replace("g", "").strip())
+
+
 def nutrient_calculator_tool(input_str: str) -> str:
     """
     Expects input like: "Butter, regular | 9.46g"
     """
     try:
-        food, quantity_str = input_str.split("|")
-        food = food.strip()
-        quantity = float(quantity_str.strip().lower().replace("g", "").strip())
+        food, quantity = parse_food_grams(input_str)
 
         result = calculate_nutrients(
             food_identifier=food,
-            measure_search_name="100g",
-            quantity=quantity,  # Since 100g is the base
+            measure_search_name=GRAMS_MEASURE,
+            quantity=quantity / 100,  # The 100g measure counts 100 g units
             debug=False
         )
 
@@ -248,11 +592,112 @@ def nutrient_calculator_tool(input_str: str) -> str:
 
 def food_selector_tool(input_str: str) -> str:
     """
-    Checks if a food exists in the CNF.
+    Checks if a food exists in the CNF and lists the closest matching CNF foods.
     Input: food name as string (e.g., "Kefir")
     """
+    query = input_str.strip()
     try:
-        food_id = get_food_id_by_name(input_str.strip())
-        return f"✅ '{input_str.strip()}' exists in CNF (Food ID: {food_id})"
+        matches = [m for m in search_foods(query, k=5) if m[2] >= min_food_match_score()]
+        if not matches:
+            raise ValueError(f"Food '{query}' not found.")
+        food_id, description, _ = matches[0]
+        others = "\n".join(f"- {d} (Food ID: {f}, score {s:.2f})" for f, d, s in matches[1:])
+        result = f"✅ '{query}' exists in CNF as '{description}' (Food ID: {food_id})"
+        return f"{result}\nOther candidates:\n{others}" if others else result
     except Exception as e:
-        return f"❌ '{input_str.strip()}' not found in CNF: {str(e)}"
+        return f"❌ '{query}' not found in CNF: {str(e)}"
+
+
+@tracing.traced("cnf.find_substitutes")
+def find_substitutes(food_identifier, grams=100.0, k=SUBSTITUTION_COUNT, **filters):
+    """
+    Foods closest in nutrients to ``grams`` of a food, searched over the whole CNF.
+
+    ``filters`` go to ``SubstitutionIndex.search`` (``food_groups``, ``same_group``,
+    ``live_microbes``, ``match_energy``, ``weights``).
+    """
+    refresh_memory_engine()
+    food_id = get_food_id_by_name(food_identifier)
+    return food_id, get_substitution_index().search(food_id, grams, k, **filters)
+
+
+def food_substitution_tool(input_str: str) -> str:
+    """
+    Lists CNF foods that can replace a food portion with roughly the same nutrition.
+    Input: "food | grams", optionally followed by "| options" with any of
+    "live microbes", "same group" or "group: <food group>", e.g.
+    "Cream, sour, cultured, 14% M.F | 30g | live microbes"
+    """
+    try:
+        parts = [part.strip() for part in input_str.split("|")]
+        food, grams = parse_food_grams(" | ".join(parts[:2]))
+        filters = {"food_groups": []}
+        for option in (o.strip().lower() for part in parts[2:] for o in part.split(",")):
+            if option.startswith("live"):
+                filters["live_microbes"] = True
+            elif option == "same group":
+                filters["same_group"] = True
+            elif option.startswith("group"):
+                filters["food_groups"].append(option.split(":", 1)[-1].strip())
+
+        food_id, substitutes = find_substitutes(food, grams, **filters)
+        if substitutes.empty:
+            return f"❌ No substitutes found for {food} with these filters."
+
+        summary = [n for n in RECALL_SUMMARY_NUTRIENTS if n in substitutes.columns]
+        lines = []
+        for _, row in substitutes.iterrows():
+            values = ", ".join(f"{n}: {row[n]:.2f}" for n in summary if pd.notna(row[n]))
+            tag = ", live microbes" if row["live_microbes"] else ""
+            lines.append(f"- {row['description']} (Food ID: {row['food_id']}, {row['food_group']}{tag}): "
+                         f"{row['grams']:.0f}g, distance {row['distance']:.2f}; {values}")
+        return f"✅ Substitutes for {food} ({grams}g, Food ID: {food_id}), closest first:\n" + "\n".join(lines)
+
+    except Exception as e:
+        return f"❌ Error in FoodSubstitution: {str(e)}"
+
+
+def recall_nutrient_calculator_tool(input_str: str) -> str:
+    """
+    Computes nutrients for a whole dietary recall in one call.
+    Input: one "food | grams" item per line or separated by ";", e.g.
+    "Butter, regular | 9.46g; Deli-meat, pepperoni | 102g"
+    """
+    try:
+        lines = [line.strip().rstrip(",") for line in input_str.replace(";", "\n").splitlines()]
+        items = [parse_food_grams(line) for line in lines if line.strip("{} ")]
+        if not items:
+            return "❌ No recall items found."
+
+        per_item, totals = calculate_recall_nutrients([(food, grams / 100) for food, grams in items])
+        summary = [n for n in RECALL_SUMMARY_NUTRIENTS if n in totals.index]
+
+        item_lines = []
+        for (food, grams), (_, row) in zip(items, per_item.iterrows()):
+            if row["error"]:
+                item_lines.append(f"- ❌ {food} ({grams}g): {row['error']}")
+                continue
+            values = ", ".join(f"{n}: {row[n]:.2f}" for n in summary if pd.notna(row[n]))
+            item_lines.append(f"- {food} ({grams}g): {values}")
+        total_lines = [f"{name}: {amount:.2f}" for name, amount in totals.dropna().items()]
+        return (f"✅ Nutrient summary for recall ({len(items)} items):\n" + "\n".join(item_lines)
+                + "\n\nDay totals:\n" + "\n".join(total_lines))
+
+    except Exception as e:
+        return f"❌ Error in RecallNutrientCalculator: {str(e)}"
+
+
+# Async variants for the agent's Tool(coroutine=...): the blocking SQLAlchemy / NumPy work runs in
+# worker threads, so parallel tool calls of one agent step overlap and sessions can share an event loop
+
+async def anutrient_calculator_tool(input_str: str) -> str:
+    return await asyncio.to_thread(nutrient_calculator_tool, input_str)
+
+async def afood_selector_tool(input_str: str) -> str:
+    return await asyncio.to_thread(food_selector_tool, input_str)
+
+async def arecall_nutrient_calculator_tool(input_str: str) -> str:
+    return await asyncio.to_thread(recall_nutrient_calculator_tool, input_str)
+
+async def afood_substitution_tool(input_str: str) -> str:
+    return await asyncio.to_thread(food_substitution_tool, input_str)
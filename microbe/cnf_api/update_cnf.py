@@ -1,30 +1,57 @@
+import json
 import os
 import pandas as pd
+from datetime import datetime
 from glob import glob
 
+from cnf_csv import CNF_CSV_FILES, CNF_NATURAL_KEYS, build_snapshot, data_version, normalize_column_name, pa
+
 # Paths
 base_dir = r"/api_data/CNF"
 update_dir = r"C:\Users\mario\Downloads\cnf-fcen-csv-update-miseajour"
 output_dir = base_dir  # Change if you want to save to a different folder
 
-# Mapping table base names to primary key column
+# Rows of a base table processed at a time
+CHUNK_ROWS = 200_000
+
+# Written to output_dir after every run; lists the keys each table gained, lost or changed
+MANIFEST_FILE = "cnf_update_manifest.json"
+
+# Mapping table base names to their key columns (composite for the amount and conversion tables)
 table_primary_keys = {
-    "YIELD NAME": "YieldID",
-    "REFUSE NAME": "RefuseID",
-    "MEASURE NAME": "MeasureID",
-    "FOOD NAME": "FoodID",
-    "FOOD GROUP": "FoodGroupID",
-    "FOOD SOURCE": "FoodSourceID",
-    "NUTRIENT NAME": "NutrientID",
-    "NUTRIENT SOURCE": "NutrientSourceID",
+    os.path.splitext(filename)[0]: [col_map[column] for column in CNF_NATURAL_KEYS[table]]
+    for table, (filename, col_map) in CNF_CSV_FILES.items()
 }
 
 
+def read_update_file(path, columns):
+    """Read a DELETE/CHANGED/ADD file with normalized headers, aligned to the base columns."""
+    df = pd.read_csv(path, dtype=str, encoding="latin1")
+    df.columns = [normalize_column_name(c) for c in df.columns]
+    return df.dropna(how="all").reindex(columns=columns)
+
+
+def row_keys(df, primary_key):
+    """One string per row joining its key columns, so composite keys can be matched with ``isin``."""
+    keys = df[primary_key[0]].fillna("").str.strip()
+    for column in primary_key[1:]:
+        keys = keys + "\x1f" + df[column].fillna("").str.strip()
+    return keys
+
+
 def apply_updates(base_file, update_files, primary_key):
-    print(f"\nProcessing base file: {os.path.basename(base_file)} (primary key: {primary_key})")
+    """
+    Apply DELETE, CHANGED and ADD files to a base table in one streaming pass.
+
+    The base CSV is read in chunks. Rows whose key is deleted or changed are dropped, the
+    CHANGED rows and then the ADD rows are appended, and repeated keys keep their first row
+    (this replaces the separate deduplication pass). The result is written to a temporary
+    file and renamed over the output, and only if something actually changed.
 
-    # Read the base CSV
-    base_df = pd.read_csv(base_file, dtype=str, encoding="latin1")
+    Returns:
+        dict: Keys added, changed and deleted, with row counts before and after.
+    """
+    print(f"\nProcessing base file: {os.path.basename(base_file)} (key: {', '.join(primary_key)})")
 
     # Map update type to suffix
     updates = {'ADD': None, 'CHANGED': None, 'DELETE': None}
@@ -33,79 +60,100 @@ def apply_updates(base_file, update_files, primary_key):
         if matched:
             updates[suffix] = matched[0]
 
-    # Apply DELETE
-    if updates['DELETE']:
-        delete_df = pd.read_csv(updates['DELETE'], dtype=str, encoding="latin1")
-        print(f" - Deleting {len(delete_df)} rows")
-        base_df = base_df[~base_df[primary_key].isin(delete_df[primary_key])]
-
-    # Apply CHANGED
-    if updates['CHANGED']:
-        changed_df = pd.read_csv(updates['CHANGED'], dtype=str, encoding="latin1")
-        print(f" - Changing {len(changed_df)} rows")
-        base_df = base_df[~base_df[primary_key].isin(changed_df[primary_key])]
-        base_df = pd.concat([base_df, changed_df], ignore_index=True)
-
-    # Apply ADD
-    if updates['ADD']:
-        add_df = pd.read_csv(updates['ADD'], dtype=str, encoding="latin1")
-        print(f" - Adding {len(add_df)} rows")
-        base_df = pd.concat([base_df, add_df], ignore_index=True)
-
-    # Save updated file
-    output_path = os.path.join(output_dir, os.path.basename(base_file))
-    base_df.to_csv(output_path, index=False)
-    print(f" - Saved updated file to: {output_path}")
-
-
-def deduplicate_all_files():
-    print("\n--- Deduplicating all updated files ---")
-
-    base_files = glob(os.path.join(output_dir, "*.csv"))
-
-    for base_file in base_files:
-        base_name = os.path.splitext(os.path.basename(base_file))[0]
-        primary_key = table_primary_keys.get(base_name)
+    header = pd.read_csv(base_file, dtype=str, encoding="latin1", nrows=0).columns
+    columns = [normalize_column_name(c) for c in header]
+    deltas = {suffix: read_update_file(path, columns) for suffix, path in updates.items() if path}
+    for suffix, df in deltas.items():
+        print(f" - {suffix}: {len(df)} rows")
+    delete_keys = set(row_keys(deltas['DELETE'], primary_key)) if 'DELETE' in deltas else set()
+    changed_keys = set(row_keys(deltas['CHANGED'], primary_key)) if 'CHANGED' in deltas else set()
+    dropped = delete_keys | changed_keys
 
-        if not primary_key:
-            continue  # Skip files without a known primary key
-
-        df = pd.read_csv(base_file, dtype=str, encoding="latin-1")
-        before = len(df)
-        df = df.drop_duplicates(subset=[primary_key])
-        after = len(df)
-
-        if before != after:
-            print(f" - {base_name}: removed {before - after} duplicate rows based on {primary_key}")
-            df.to_csv(base_file, index=False, encoding="latin-1")
-        else:
-            print(f" - {base_name}: no duplicates found.")
+    output_path = os.path.join(output_dir, os.path.basename(base_file))
+    tmp_path = output_path + ".tmp"
+    before_keys, written_keys = set(), set()
+    rows_before = rows_after = duplicates = 0
+    with open(tmp_path, "w", encoding="latin1", newline="") as out:
+        pd.DataFrame(columns=header).to_csv(out, index=False)
+
+        def write(df):
+            nonlocal rows_after, duplicates
+            keys = row_keys(df, primary_key)
+            keep = ~keys.duplicated() & ~keys.isin(written_keys)
+            duplicates += int((~keep).sum())
+            written_keys.update(keys[keep])
+            rows_after += int(keep.sum())
+            df[keep].to_csv(out, index=False, header=False)
+
+        for chunk in pd.read_csv(base_file, dtype=str, encoding="latin1", chunksize=CHUNK_ROWS):
+            chunk.columns = columns
+            # Drop the blank padding rows some CNF files carry
+            chunk = chunk.dropna(how="all")
+            rows_before += len(chunk)
+            keys = row_keys(chunk, primary_key)
+            before_keys.update(keys)
+            write(chunk[~keys.isin(dropped).to_numpy()])
+        for suffix in ('CHANGED', 'ADD'):
+            if suffix in deltas:
+                write(deltas[suffix])
+
+    added = written_keys - before_keys
+    deleted = before_keys - written_keys
+    changed = changed_keys & before_keys & written_keys
+    if not (added or deleted or changed or duplicates or rows_before != rows_after):
+        os.remove(tmp_path)
+        print(" - No changes.")
+    else:
+        os.replace(tmp_path, output_path)
+        print(f" - {len(added)} added, {len(changed)} changed, {len(deleted)} deleted, "
+              f"{duplicates} duplicate rows removed; saved to: {output_path}")
+
+    def split(keys):
+        return sorted(key.split("\x1f") for key in keys)
+
+    return {"key": primary_key, "rows_before": rows_before, "rows_after": rows_after,
+            "duplicates_removed": duplicates,
+            "added": split(added), "changed": split(changed), "deleted": split(deleted)}
+
+
+def write_manifest(tables, version_before):
+    """Atomically write the change manifest that caches, indexes and the DB sync refresh from."""
+    manifest = {"created": datetime.now().isoformat(timespec="seconds"), "version_before": version_before,
+                "version_after": data_version(output_dir), "tables": tables}
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+    print(f"\nChange manifest written to: {path}")
+    return manifest
 
 
 def main():
-    # First apply updates
+    version_before = data_version(output_dir)
     base_files = glob(os.path.join(base_dir, "*.csv"))
 
+    tables = {}
     for base_file in base_files:
         base_name = os.path.splitext(os.path.basename(base_file))[0]
 
-        # Find matching update files
-        update_files = glob(os.path.join(update_dir, f"{base_name}*.csv"))
-
-        if not update_files:
-            print(f"\nNo updates found for: {base_name}")
-            continue
-
-        # Determine primary key
+        # Determine key columns
         primary_key = table_primary_keys.get(base_name)
         if not primary_key:
             print(f"\nWarning: No primary key mapping found for {base_name}, skipping...")
             continue
 
-        apply_updates(base_file, update_files, primary_key)
+        # Find matching update files; tables without any still get deduplicated
+        update_files = glob(os.path.join(update_dir, f"{base_name}*.csv"))
+        if not update_files:
+            print(f"\nNo updates found for: {base_name}")
+
+        tables[base_name] = apply_updates(base_file, update_files, primary_key)
+
+    write_manifest(tables, version_before)
 
-    # Then deduplicate
-    deduplicate_all_files()
+    # Refresh the columnar snapshot readers load instead of the CSVs
+    if pa is not None:
+        build_snapshot(output_dir)
 
 
 if __name__ == "__main__":
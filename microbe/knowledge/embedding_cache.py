@@ -0,0 +1,123 @@
+# Persistent embedding cache in front of the vectorstore embedding function
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from microbe import tracing
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".embedding_cache")
+
+
+def text_key(text, kind="document"):
+    """Hash of a text, separating documents from queries since models may encode them differently."""
+    return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an ``Embeddings`` object with an on-disk cache keyed by (model, normalize flag, text hash).
+
+    Each (model, normalize) pair gets its own folder under ``cache_dir`` with
+    ``vectors.f32``, an append-only float32 matrix read through ``np.memmap``,
+    and ``keys.txt``, the vector size followed by the text hash of each row.
+    Only texts missing from the cache reach the wrapped model, so rebuilds
+    and repeated queries over the same text skip it entirely. Safe for
+    threads of one process; don't share a cache folder between concurrent
+    writers.
+
+    Args:
+        embeddings: The wrapped embedding function (e.g. ``HuggingFaceEmbeddings``).
+        model_name (str): Model identifier, part of the cache key.
+        normalize (bool): Whether the model normalizes its vectors, part of the cache key.
+        cache_dir (str): Root folder of the cache.
+    """
+
+    def __init__(self, embeddings, model_name, normalize=True, cache_dir=DEFAULT_CACHE_DIR):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.normalize = normalize
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+        self.path = os.path.join(cache_dir, f"{slug}-{'norm' if normalize else 'raw'}")
+        os.makedirs(self.path, exist_ok=True)
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._keys_path = os.path.join(self.path, "keys.txt")
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+        self.dim = None
+        self._rows = {}
+        self._matrix = None
+        if os.path.exists(self._keys_path):
+            self._load()
+
+    def _load(self):
+        """Read keys.txt ("dim=<n>" then one key per row), dropping rows a crash left half-written."""
+        with open(self._keys_path, encoding="ascii") as f:
+            lines = f.read().split()
+        if not lines:
+            return
+        self.dim = int(lines[0].split("=")[1])
+        vector_bytes = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        keys = lines[1:vector_bytes // (4 * self.dim) + 1]
+        if len(keys) != len(lines) - 1 or vector_bytes != len(keys) * 4 * self.dim:
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(len(keys) * 4 * self.dim)
+            with open(self._keys_path, "w", encoding="ascii") as f:
+                f.write("".join(f"{line}\n" for line in [lines[0]] + keys))
+        self._rows = {key: row for row, key in enumerate(keys)}
+        if keys:
+            self._remap()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _remap(self):
+        """Re-open the memmap after rows were appended."""
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._rows), self.dim))
+
+    def _append(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self._keys_path, "w", encoding="ascii") as f:
+                f.write(f"dim={self.dim}\n")
+            open(self._vectors_path, "wb").close()
+        # Vectors first: on a crash, keys.txt never points past the matrix
+        with open(self._vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self._keys_path, "a", encoding="ascii") as f:
+            f.write("".join(f"{key}\n" for key in keys))
+        for key in keys:
+            self._rows[key] = len(self._rows)
+        self._remap()
+
+    def _embed(self, texts, kind, compute):
+        if not texts:
+            return []
+        keys = [text_key(text, kind) for text in texts]
+        with self._lock:
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows and key not in missing:
+                    missing[key] = text
+            self.stats["hits"] += len(keys) - len(missing)
+            self.stats["misses"] += len(missing)
+        if missing:
+            with tracing.span("embedding.model", texts=len(missing), kind=kind):
+                vectors = compute(list(missing.values()))
+            with self._lock:
+                new = [(key, vector) for key, vector in zip(missing, vectors) if key not in self._rows]
+                if new:
+                    self._append([key for key, _ in new], [vector for _, vector in new])
+        with self._lock:
+            return self._matrix[[self._rows[key] for key in keys]].tolist()
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts), "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed([text], "query", lambda texts: [self.embeddings.embed_query(texts[0])])[0]
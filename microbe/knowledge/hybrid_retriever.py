@@ -0,0 +1,221 @@
+# Hybrid sparse (BM25) + dense retrieval over the vectorstore chunks, with optional reranking
+import re
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from microbe import tracing
+
+# Cross-encoder used when reranking is enabled (small enough for CPU)
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Words too common in the guidelines and papers to carry any signal
+STOPWORDS = set("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+
+def tokenize(text):
+    """Lowercase, accent-free word tokens without stopwords ("Kéfir, live microbes" -> kefir live microbes)."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a list of texts, with the postings held as CSR arrays.
+
+    Args:
+        texts (list): Documents to index.
+        k1 (float): Term-frequency saturation.
+        b (float): Length normalization.
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        term_ids, doc_ids, counts = [], [], []
+        lengths = []
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            terms, tf = np.unique([self.vocabulary.setdefault(t, len(self.vocabulary)) for t in tokens],
+                                  return_counts=True)
+            term_ids.extend(terms.tolist())
+            doc_ids.extend([doc] * len(terms))
+            counts.extend(tf.tolist())
+
+        self.doc_lengths = np.asarray(lengths, dtype=np.float64)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.vocabulary)), out=self.indptr[1:])
+        self.docs = np.asarray(doc_ids, dtype=np.int32)[order]
+        self.term_freqs = np.asarray(counts, dtype=np.float64)[order]
+
+        n = len(self.doc_lengths)
+        df = np.diff(self.indptr)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+        self._norm = k1 * (1 - b + b * self.doc_lengths / max(self.doc_lengths.mean(), 1e-9)) if n else None
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def scores(self, query):
+        """BM25 score of every document for ``query``."""
+        scores = np.zeros(len(self))
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs, tf = self.docs[start:end], self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._norm[docs])
+        return scores
+
+    def search(self, query, k=10):
+        """Top-``k`` ``(doc, score)`` pairs with a positive score, best first."""
+        scores = self.scores(query)
+        k = min(k, int((scores > 0).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """
+    Fuse ranked id lists: each id scores ``sum(1 / (rrf_k + rank))`` over the lists it appears in.
+
+    Returns:
+        list: ``(id, score)`` pairs, best first; ties keep first-seen order.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+class CrossEncoderReranker:
+    """
+    CPU cross-encoder reranking with a latency budget.
+
+    Candidates are scored in batches in their incoming order; once ``budget_s``
+    is spent, the remaining candidates keep their order behind the scored ones
+    (the first batch is always scored).
+
+    Args:
+        model_name (str): sentence-transformers cross-encoder.
+        budget_s (float): Seconds allowed per query.
+        batch_size (int): Pairs scored per forward pass.
+        max_length (int): Token limit of each (query, passage) pair.
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, budget_s=0.5, batch_size=8, max_length=256, device="cpu"):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+        self.budget_s = budget_s
+        self.batch_size = batch_size
+
+    def rerank(self, query, documents):
+        """Return ``(documents, scores)`` reordered by relevance; unscored documents get ``None``."""
+        start = time.perf_counter()
+        scores = []
+        for offset in range(0, len(documents), self.batch_size):
+            if offset and time.perf_counter() - start > self.budget_s:
+                break
+            batch = documents[offset:offset + self.batch_size]
+            scores.extend(self.model.predict([(query, doc.page_content) for doc in batch]).tolist())
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])
+        ranked = [documents[i] for i in order] + documents[len(scores):]
+        return ranked, [scores[i] for i in order] + [None] * (len(documents) - len(scores))
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Reciprocal-rank fusion of BM25 and dense search over the same chunks, optionally reranked.
+
+    ``dense_k`` and ``sparse_k`` candidates come from the vectorstore and the
+    BM25 index, are fused with RRF, and the best ``rerank_k`` of them go
+    through the reranker (when set) before the top ``k`` are returned. Larger
+    candidate sets raise recall at the cost of latency. Each returned document
+    carries its ``rrf_score`` (and ``rerank_score``) in its metadata.
+    """
+
+    vectorstore: object
+    bm25: object
+    doc_ids: list
+    texts: list
+    metadatas: list
+    k: int = 4
+    dense_k: int = 20
+    sparse_k: int = 20
+    rrf_k: int = 60
+    rerank_k: int = 20
+    reranker: object = None
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs):
+        """Build the BM25 index from every chunk stored in a Chroma vectorstore."""
+        stored = vectorstore.get(include=["documents", "metadatas"])
+        return cls(vectorstore=vectorstore, bm25=BM25Index(stored["documents"]), doc_ids=stored["ids"],
+                   texts=stored["documents"], metadatas=stored["metadatas"], **kwargs)
+
+    def sparse_search(self, query, k):
+        return [Document(id=self.doc_ids[i], page_content=self.texts[i], metadata=dict(self.metadatas[i] or {}))
+                for i, _ in self.bm25.search(query, k)]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        with tracing.span("retrieval.dense", k=self.dense_k):
+            dense = self.vectorstore.similarity_search(query, k=self.dense_k) if self.dense_k else []
+        with tracing.span("retrieval.sparse", k=self.sparse_k):
+            sparse = self.sparse_search(query, self.sparse_k) if self.sparse_k else []
+
+        by_id = {}
+        for doc in dense + sparse:
+            by_id.setdefault(doc.id or doc.page_content, doc)
+        fused = reciprocal_rank_fusion([[doc.id or doc.page_content for doc in dense],
+                                        [doc.id or doc.page_content for doc in sparse]], self.rrf_k)
+        documents = []
+        for key, score in fused:
+            doc = by_id[key]
+            documents.append(Document(id=doc.id, page_content=doc.page_content,
+                                      metadata={**doc.metadata, "rrf_score": score}))
+
+        if self.reranker is not None:
+            with tracing.span("retrieval.rerank", candidates=min(self.rerank_k, len(documents))):
+                head, rerank_scores = self.reranker.rerank(query, documents[:self.rerank_k])
+            for doc, score in zip(head, rerank_scores):
+                doc.metadata["rerank_score"] = score
+            documents = head + documents[self.rerank_k:]
+        return documents[:self.k]
+
+
+def create_hybrid_retriever(vectorstore, k=4, dense_k=20, sparse_k=20, rerank_model=None, rerank_k=20,
+                            rerank_budget_s=0.5):
+    """
+    Hybrid BM25 + dense retriever over a vectorstore built by ``create_vectorstore``.
+
+    Args:
+        vectorstore: The Chroma vectorstore.
+        k (int): Documents returned.
+        dense_k (int): Dense candidates per query.
+        sparse_k (int): BM25 candidates per query.
+        rerank_model (str): Cross-encoder to rerank with (e.g. ``DEFAULT_RERANK_MODEL``); None to skip reranking.
+        rerank_k (int): Fused candidates passed to the reranker.
+        rerank_budget_s (float): Reranking time budget per query.
+    """
+    start = time.perf_counter()
+    reranker = CrossEncoderReranker(rerank_model, budget_s=rerank_budget_s) if rerank_model else None
+    retriever = HybridRetriever.from_vectorstore(vectorstore, k=k, dense_k=dense_k, sparse_k=sparse_k,
+                                                 rerank_k=rerank_k, reranker=reranker)
+    print(f"✅ Hybrid retriever over {len(retriever.bm25)} chunks ready in {time.perf_counter() - start:.2f}s"
+          f"{f' (reranking with {rerank_model})' if rerank_model else ''}")
+    return retriever
@@ -1,122 +1,476 @@
 import glob
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
-from concurrent.futures.thread import ThreadPoolExecutor
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
-import langchain_chroma
-from langchain_community.document_loaders import DirectoryLoader, PyMuPDFLoader, CSVLoader, UnstructuredXMLLoader
+from langchain_community.document_loaders import PyMuPDFLoader, CSVLoader, UnstructuredXMLLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from tqdm import tqdm
 
+from microbe import tracing
+from microbe.knowledge.embedding_cache import DEFAULT_CACHE_DIR, CachedEmbeddings
+from microbe.knowledge.vector_index import NumpyVectorStore
+
+# Bumped when the manifest layout or chunk id scheme changes
+MANIFEST_VERSION = 1
+
+# Chunks written to Chroma per add/delete call
+CHROMA_BATCH_SIZE = 1000
+
+# Embedding batch size bounds; on CPU the batch grows with available memory
+MIN_EMBED_BATCH_SIZE = 16
+MAX_CPU_EMBED_BATCH_SIZE = 256
+GPU_EMBED_BATCH_SIZE = 512
+
+# Knowledge base and vectorstore of the notebooks, from the repository root
+DEFAULT_KNOWLEDGE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "knowledge"))
+DEFAULT_DB_NAME = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "diet_vector_db"))
+
+# Parsed page text of each knowledge file, keyed by its SHA-256
+DEFAULT_PAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".page_cache")
+
+# Bumped when the cached page layout changes
+PAGE_CACHE_VERSION = 1
+
+# Files queued per parse worker, so parsing runs only a little ahead of the embedding stage
+PARSE_QUEUE_PER_WORKER = 4
+
+# A parse process takes seconds to start (importing the loaders); fewer files than this per process parse in-process
+MIN_FILES_PER_PROCESS = 16
+
+KNOWLEDGE_LOADERS = {
+    '.pdf': PyMuPDFLoader,
+    '.xml': UnstructuredXMLLoader,
+    '.csv': CSVLoader,
+}
+
 
 def add_metadata(doc, doc_type):
     doc.metadata["doc_type"] = doc_type
     return doc
 
-def load_documents_by_type(folder, file_type, loaders):
-    loader = DirectoryLoader(folder, glob=f"**/*{file_type}", loader_cls=loaders[file_type])
-    documents = loader.load()
-    #print("The following documents were loaded:")
-    #for doc in documents:
-    #    print(f" - {doc.metadata.get('source', 'Unknown source')}")
-    doc_type = os.path.basename(folder)
+def page_cache_path(page_cache_dir, sha256, loader):
+    return os.path.join(page_cache_dir, sha256[:2], f"{sha256}-{loader.__name__}-v{PAGE_CACHE_VERSION}.json")
+
+def load_file(path, loaders, page_cache_dir=None, sha256=None, root=None):
+    """
+    Load one knowledge file, tagged with its top-level folder under ``root`` as doc_type
+    (with its parent folder when ``root`` is None).
+
+    With ``page_cache_dir``, the parsed pages are kept under the file's SHA-256
+    (``sha256`` if already known), so an unchanged file is parsed only once,
+    even after it is moved or renamed.
+    """
+    loader = loaders[os.path.splitext(path)[1].lower()]
+    cache_path = page_cache_path(page_cache_dir, sha256 or file_sha256(path), loader) if page_cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            pages = json.load(f)
+        # The cached path may be another copy of the same file
+        documents = [Document(page_content=page["page_content"],
+                              metadata={**page["metadata"],
+                                        **{k: path for k in ("source", "file_path") if k in page["metadata"]}})
+                     for page in pages]
+    else:
+        documents = loader(path).load()
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents], f)
+            os.replace(tmp_path, cache_path)
+    if root:
+        doc_type = os.path.relpath(path, root).split(os.sep)[0]
+    else:
+        doc_type = os.path.basename(os.path.dirname(path))
     return [add_metadata(doc, doc_type) for doc in documents]
 
-def load_knowledge_base(folders, loaders):
-    documents = []
-    for folder in folders:
-        documents.extend(load_documents_by_type(folder, ".pdf", loaders))
-        documents.extend(load_documents_by_type(folder, ".csv", loaders))
+def list_knowledge_files(knowledge_dir, extensions=tuple(KNOWLEDGE_LOADERS)):
+    """All knowledge files under the folders of knowledge_dir, keyed by path relative to it."""
+    files = {}
+    for folder in glob.glob(f"{knowledge_dir}/*"):
+        for ext in extensions:
+            for path in glob.glob(os.path.join(folder, "**", f"*{ext}"), recursive=True):
+                files[os.path.relpath(path, knowledge_dir).replace(os.sep, "/")] = path
+    return dict(sorted(files.items()))
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_ids(source, chunks):
+    """Content-addressed chunk ids: hash of source and text, plus a counter for repeated text."""
+    seen = {}
+    ids = []
+    for chunk in chunks:
+        digest = hashlib.sha256(f"{source}\0{chunk.page_content}".encode("utf-8")).hexdigest()[:32]
+        seen[digest] = seen.get(digest, -1) + 1
+        ids.append(f"{digest}-{seen[digest]}")
+    return ids
 
-    return documents
+def manifest_path(db_name):
+    """The manifest lives next to the persist directory: <db_name>.manifest.json"""
+    return os.path.normpath(db_name) + ".manifest.json"
 
-def split_documents(documents, chunk_size=1000, chunk_overlap=200):
+def vectorstore_version(db_name):
+    """
+    Hash of the manifest of ``db_name``: changes whenever an update adds, changes or removes chunks, or
+    the store is rebuilt. Pass ``lambda: vectorstore_version(db_name)`` as a ToolCache ``version``.
+    """
+    path = manifest_path(db_name)
+    return file_sha256(path) if os.path.exists(path) else ""
+
+def load_manifest(db_name):
+    path = manifest_path(db_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(db_name, manifest):
+    path = manifest_path(db_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+def file_hashes(files, workers=8):
+    """SHA-256 of every ``{source: path}``, read in threads (hashlib releases the GIL on large blocks)."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(files, executor.map(file_sha256, files.values())))
+
+def split_documents(documents, chunk_size=1000, chunk_overlap=200, verbose=True):
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     chunks = text_splitter.split_documents(documents)
 
-    print(f"Total number of chunks: {len(chunks)}")
-    print(f"Document types found: {set(doc.metadata['doc_type'] for doc in documents)}")
+    if verbose:
+        print(f"Total number of chunks: {len(chunks)}")
+        print(f"Document types found: {set(doc.metadata['doc_type'] for doc in documents)}")
     return chunks
 
-def get_embedding_function(embedding_type="hugging_face", embedding_model="BAAI/bge-small-en-v1.5"):
+def default_device():
+    """"cuda" or "mps" when torch can see one, else "cpu"."""
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+def available_memory_gb():
+    """MemAvailable from /proc/meminfo (free pages elsewhere), or 4 GB when neither can be read."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return 4.0
+
+def embedding_resources(device=None):
+    """
+    Size the embedding stage for this machine.
+
+    Returns:
+        dict: ``device``, ``batch_size`` (chunks per encode call; on CPU about
+        32 per free GB, as a power of two) and ``workers`` (parse/split processes,
+        leaving most cores to the model on CPU).
+    """
+    device = device or default_device()
+    cores = os.cpu_count() or 1
+    if device == "cpu":
+        batch_size = min(MAX_CPU_EMBED_BATCH_SIZE, max(MIN_EMBED_BATCH_SIZE, int(32 * available_memory_gb())))
+        batch_size = 1 << (batch_size.bit_length() - 1)
+        workers = max(1, min(4, cores // 4))
+    else:
+        batch_size = GPU_EMBED_BATCH_SIZE
+        workers = max(1, min(8, cores // 2))
+    return {"device": device, "batch_size": batch_size, "workers": workers}
+
+def get_embedding_function(embedding_type="hugging_face", embedding_model="BAAI/bge-small-en-v1.5", device=None,
+                           batch_size=None, cache_dir=DEFAULT_CACHE_DIR):
+    """The embedding model, behind a persistent CachedEmbeddings unless ``cache_dir`` is None."""
+    resources = embedding_resources(device)
+    normalize = True
     if embedding_type == "hugging_face":
+        from langchain_huggingface import HuggingFaceEmbeddings
+
         embedding_function = HuggingFaceEmbeddings(
             model_name=embedding_model,
-            model_kwargs={"device": "cuda"},  # or "cpu"
-            encode_kwargs={"normalize_embeddings": True}
+            model_kwargs={"device": resources["device"]},
+            encode_kwargs={"normalize_embeddings": normalize, "batch_size": batch_size or resources["batch_size"]}
         )
+    if cache_dir:
+        embedding_function = CachedEmbeddings(embedding_function, embedding_model, normalize, cache_dir)
     return embedding_function
 
 def embed_batch(batch, embedding_function):
     texts = [doc.page_content for doc in batch]
-    return embedding_function.embed_documents(texts)
-
-def create_embeddings(batch_size=512):
-    chunks = split_documents(load_knowledge_base(
-        folders = glob.glob("../knowledge/*"),
-        loaders={
-            ".pdf": DirectoryLoader,
-            ".csv": DirectoryLoader
-        }
-    ))
-    # Split docs into batches
-    batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
-
-    all_embeddings = []
-    docs = []
-
-    with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(embed_batch, batch) for batch in batches]
-        for future, batch in tqdm(zip(futures, batches), total=len(batches)):
-            embeddings = future.result()
-            all_embeddings.extend(embeddings)
-            docs.extend(batch)
-    return docs
-
-
-def create_vectorstore(db_name, knowledge_dir="../../knowledge", force=False):
-    chunks = split_documents(load_knowledge_base(
-        folders=glob.glob(f"{knowledge_dir}/*"),
-        loaders={
-            '.pdf': PyMuPDFLoader,
-            '.xml': UnstructuredXMLLoader,
-            '.csv': CSVLoader,
-        }
-    ))
-    # Delete if already exists
-    exists = False
-    if os.path.exists(db_name):
-        exists = True
-        if force:
-            print(f"Deleting existing vectorstore at {db_name}")
-            from langchain_community.vectorstores import Chroma
-            Chroma(persist_directory=db_name).delete_collection()
-            exists = False
-
-    if exists:
-        print(f"Vectorstore already exists at {db_name}. Use force=True to delete it.")
-        db = langchain_chroma.Chroma(
-            embedding_function=get_embedding_function(),
-            persist_directory=db_name
-        )
+    with tracing.span("embedding.batch", texts=len(texts)):
+        return embedding_function.embed_documents(texts)
+
+def load_and_split(path, loaders=KNOWLEDGE_LOADERS, chunk_size=1000, chunk_overlap=200, page_cache_dir=None,
+                   sha256=None, root=None):
+    return split_documents(load_file(path, loaders, page_cache_dir, sha256, root), chunk_size=chunk_size,
+                           chunk_overlap=chunk_overlap, verbose=False)
+
+def map_files(func, files, hashes=None, workers=1, **kwargs):
+    """
+    Call ``func(path, sha256=..., **kwargs)`` for each ``{source: path}`` in a pool of ``workers``
+    processes, yielding (source, result) as each file is done.
+
+    Only ``PARSE_QUEUE_PER_WORKER`` files per worker are submitted ahead, so a
+    knowledge base of thousands of files streams through in bounded memory at
+    the pace its results are consumed. With ``workers=1``, or fewer than
+    ``MIN_FILES_PER_PROCESS`` files per process, files are parsed in a single
+    background thread instead, which still runs ahead of the consumer (e.g.
+    the embedding model, which releases the GIL while it encodes).
+    """
+    hashes = hashes or {}
+    workers = min(workers, len(files) // MIN_FILES_PER_PROCESS)
+    if workers <= 1:
+        workers = 1
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parse")
     else:
-        print(f"Creating new vectorstore at {db_name}")
-        # Now create the vectorstore with precomputed embeddings
-        db = langchain_chroma.Chroma.from_documents(
-            documents=chunks,
-            embedding=get_embedding_function(),
-            persist_directory=db_name
-        )
+        # Not fork: the parent may already run the embedding model's threads. A forkserver
+        # imports this module once and forks the workers from it; spawn imports it in each one.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([func.__module__])
+        else:
+            context = multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    pending = iter(files.items())
+    with executor:
+        futures = {}
+
+        def submit(count):
+            for source, path in itertools.islice(pending, count):
+                futures[executor.submit(func, path, sha256=hashes.get(source), **kwargs)] = source
+
+        submit(workers * PARSE_QUEUE_PER_WORKER)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures.pop(future), future.result()
+            submit(len(done))
+
+def iter_file_chunks(files, loaders=KNOWLEDGE_LOADERS, chunk_size=1000, chunk_overlap=200, workers=1,
+                     page_cache_dir=None, hashes=None, root=None):
+    """
+    Parse and split ``{source: path}`` ahead of the consumer (see ``map_files``), yielding (source, chunks) as each file is done.
+
+    Chunks are tagged with their top-level folder under ``root`` (the knowledge dir) as doc_type.
+    """
+    yield from map_files(load_and_split, files, hashes, workers, loaders=loaders, chunk_size=chunk_size,
+                         chunk_overlap=chunk_overlap, page_cache_dir=page_cache_dir, root=root)
+
+def embed_stream(items, embedding_function, batch_size):
+    """
+    Embed a stream of (chunk_id, chunk) pairs batch by batch.
+
+    Batches are embedded as soon as they fill up, so embedding overlaps with
+    whatever produces ``items`` (e.g. ``iter_file_chunks`` parsing in a pool).
+
+    Yields:
+        tuple: (chunk ids, chunks, vectors) for each batch.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield [i for i, _ in batch], [c for _, c in batch], embed_batch([c for _, c in batch], embedding_function)
+            batch = []
+    if batch:
+        yield [i for i, _ in batch], [c for _, c in batch], embed_batch([c for _, c in batch], embedding_function)
+
+def create_embeddings(knowledge_dir=DEFAULT_KNOWLEDGE_DIR, batch_size=None, workers=None, embedding_function=None,
+                      chunk_size=1000, chunk_overlap=200, page_cache_dir=DEFAULT_PAGE_CACHE_DIR):
+    """
+    Parse, split and embed the whole knowledge base as a streaming pipeline.
+
+    Returns:
+        tuple: (chunks, embeddings) in matching order.
+    """
+    resources = embedding_resources()
+    batch_size = batch_size or resources["batch_size"]
+    embedding_function = embedding_function or get_embedding_function(batch_size=batch_size)
+    stream = iter_file_chunks(list_knowledge_files(knowledge_dir), chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                              workers=workers or resources["workers"], page_cache_dir=page_cache_dir,
+                              root=knowledge_dir)
+    items = ((chunk_id, chunk) for source, chunks in stream for chunk_id, chunk in zip(chunk_ids(source, chunks), chunks))
+
+    docs, all_embeddings = [], []
+    start = time.perf_counter()
+    for _, chunks, embeddings in tqdm(embed_stream(items, embedding_function, batch_size)):
+        docs.extend(chunks)
+        all_embeddings.extend(embeddings)
+    elapsed = time.perf_counter() - start
+    print(f"Embedded {len(docs)} chunks in {elapsed:.1f}s ({len(docs) / max(elapsed, 1e-9):.1f} chunks/s)")
+    return docs, all_embeddings
+
+def write_embeddings(db, ids, chunks, embeddings):
+    """Upsert precomputed vectors into the vectorstore, skipping the store's own embedding call."""
+    target = db if isinstance(db, NumpyVectorStore) else db._collection
+    target.upsert(
+        ids=ids,
+        embeddings=embeddings,
+        documents=[chunk.page_content for chunk in chunks],
+        metadatas=[chunk.metadata or None for chunk in chunks],
+    )
+
+
+def document_count(db):
+    """Chunks stored in a Chroma or NumPy vectorstore."""
+    return db.count() if isinstance(db, NumpyVectorStore) else db._collection.count()
+
+
+def open_vectorstore(db_name, embedding_function, backend="chroma", index_options=None):
+    """
+    The vectorstore persisted at ``db_name``.
+
+    Args:
+        backend (str): ``"chroma"``, or ``"numpy"`` for a ``NumpyVectorStore``
+            (flat or IVF, optionally int8 / PQ quantized, memory-mapped from disk).
+        index_options (dict): ``NumpyVectorStore`` options (index, quantization, nlist, nprobe, pq_dim, rerank_k).
+    """
+    if backend == "numpy":
+        return NumpyVectorStore(embedding_function=embedding_function, persist_directory=db_name,
+                                **(index_options or {}))
+    if backend != "chroma":
+        raise ValueError(f"Unknown vectorstore backend '{backend}', expected 'chroma' or 'numpy'")
+    # Imported here so the parse processes, which import this module, skip the vector store
+    import langchain_chroma
+
+    return langchain_chroma.Chroma(embedding_function=embedding_function, persist_directory=db_name)
+
+
+def delete_vectorstore(db_name, backend="chroma"):
+    if backend == "numpy":
+        NumpyVectorStore.delete_index(db_name)
+    else:
+        import langchain_chroma
+
+        langchain_chroma.Chroma(persist_directory=db_name).delete_collection()
+
+
+def create_vectorstore(db_name, knowledge_dir=DEFAULT_KNOWLEDGE_DIR, force=False, chunk_size=1000, chunk_overlap=200,
+                       embedding_model="BAAI/bge-small-en-v1.5", device=None, batch_size=None, workers=None,
+                       cache_dir=DEFAULT_CACHE_DIR, page_cache_dir=DEFAULT_PAGE_CACHE_DIR, backend="chroma",
+                       index_options=None):
+    """
+    Create or incrementally update the vectorstore for the knowledge base.
+
+    Every source file is hashed and compared to the manifest kept next to
+    ``db_name``: unchanged files are not even parsed, chunks of new or changed
+    files are embedded only if their content is new, and chunks whose source
+    changed or disappeared are deleted. ``force=True``, or a change of
+    splitter settings or embedding model, rebuilds from scratch.
+
+    Changed files are parsed and split in ``workers`` processes (one
+    background thread for a small knowledge base, see ``map_files``) while the
+    chunks already produced are embedded in batches and upserted into Chroma
+    with their precomputed vectors. ``device``, ``batch_size`` and ``workers``
+    default to ``embedding_resources()``. Vectors are looked up in the
+    embedding cache under ``cache_dir`` first, and parsed pages in the page
+    cache under ``page_cache_dir``, so a rebuild with new splitter settings
+    does not parse the files again (``None`` disables either cache).
+
+    ``backend="numpy"`` stores the vectors in a ``NumpyVectorStore`` instead
+    of Chroma, configured by ``index_options`` (see ``open_vectorstore``);
+    changing either rebuilds the store.
+    """
+    settings = {"manifest_version": MANIFEST_VERSION, "embedding_model": embedding_model,
+                "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    if backend != "chroma":
+        settings.update(backend=backend, index_options=index_options or {})
+    resources = embedding_resources(device)
+    batch_size = batch_size or resources["batch_size"]
+    workers = workers or resources["workers"]
+
+    manifest = load_manifest(db_name)
+    rebuild = force or manifest is None or manifest.get("settings") != settings
+    if rebuild and os.path.exists(db_name):
+        print(f"Deleting existing vectorstore at {db_name}")
+        delete_vectorstore(db_name, (manifest or {"settings": settings})["settings"].get("backend", "chroma"))
+    if rebuild:
+        manifest = {"settings": settings, "files": {}}
+
+    embedding_function = get_embedding_function(
+        embedding_model=embedding_model, device=resources["device"], batch_size=batch_size, cache_dir=cache_dir)
+    db = open_vectorstore(db_name, embedding_function, backend, index_options)
+
+    files = list_knowledge_files(knowledge_dir)
+    old_files = manifest["files"]
+    new_files = {}
+    to_delete = []
+    for source in set(old_files) - set(files):
+        print(f" - Removed: {source}")
+        to_delete.extend(old_files[source]["chunks"])
+    to_parse = {}
+    hashes = file_hashes(files)
+    for source, path in files.items():
+        sha256 = hashes[source]
+        if source in old_files and old_files[source]["sha256"] == sha256:
+            new_files[source] = old_files[source]
+        else:
+            print(f" - {'Changed' if source in old_files else 'New'}: {source}")
+            to_parse[source] = path
+            new_files[source] = {"sha256": sha256}
+
+    def new_chunks():
+        """Chunks of changed files not already stored; records their ids and stale ids on the way."""
+        for source, chunks in iter_file_chunks(to_parse, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                               workers=workers, page_cache_dir=page_cache_dir, hashes=hashes,
+                                               root=knowledge_dir):
+            ids = chunk_ids(source, chunks)
+            old_ids = set(old_files.get(source, {}).get("chunks", []))
+            to_delete.extend(old_ids - set(ids))
+            new_files[source]["chunks"] = ids
+            yield from ((chunk_id, chunk) for chunk_id, chunk in zip(ids, chunks) if chunk_id not in old_ids)
+
+    print(f"Embedding on {resources['device']} with batch size {batch_size} and {workers} parse workers")
+    embedded = 0
+    start = time.perf_counter()
+    for ids, chunks, embeddings in tqdm(embed_stream(new_chunks(), embedding_function, batch_size),
+                                        disable=not to_parse):
+        write_embeddings(db, ids, chunks, embeddings)
+        embedded += len(ids)
+    elapsed = time.perf_counter() - start
 
+    for offset in range(0, len(to_delete), CHROMA_BATCH_SIZE):
+        db.delete(ids=to_delete[offset:offset + CHROMA_BATCH_SIZE])
 
-    print(f"Vectorstore at {db_name} with {db._collection.count()} documents")
+    if isinstance(db, NumpyVectorStore):
+        db.persist()
+    manifest["files"] = new_files
+    save_manifest(db_name, manifest)
+    print(f"Vectorstore at {db_name}: {embedded} chunks embedded in {elapsed:.1f}s "
+          f"({embedded / max(elapsed, 1e-9):.1f} chunks/s), {len(to_delete)} deleted, "
+          f"{document_count(db)} documents")
     return db
 
 if __name__ == "__main__":
+    # Run from the repository root: python -m microbe.knowledge.prepare_vectorstore
     # Create the vectorstore
-    db_name = "../diet_vector_db"
+    db_name = DEFAULT_DB_NAME
     db = create_vectorstore(db_name, force=False)
     db.as_retriever()
     # If you want to create embeddings separately
-    # docs = create_embeddings(batch_size=512)
+    # docs, embeddings = create_embeddings()
     # print(f"Created {len(docs)} documents with embeddings.")
\ No newline at end of file
@@ -0,0 +1,217 @@
+# Retrieval quality and latency benchmark over the knowledge corpus
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from microbe.knowledge.embedding_cache import DEFAULT_CACHE_DIR
+from microbe.knowledge.hybrid_retriever import HybridRetriever, CrossEncoderReranker
+from microbe.knowledge.prepare_vectorstore import create_vectorstore, document_count
+from microbe.knowledge.vector_index import NumpyVectorStore
+
+# Each query is labeled with phrases found in its relevant passages; a retrieved
+# chunk is relevant when it contains one of them, so labels survive re-chunking
+QUERIES = [
+    {"id": "live-microbe-foods", "query": "Which foods are high in live microbes?",
+     "relevant": ["unpasteurized fermented foods", "yogurt, kefir, and sauerkraut"]},
+    {"id": "microbe-levels", "query": "How many CFU per gram make a food low, medium or high in live microbes?",
+     "relevant": ["low (lo), <104 cfu/g", "medium (med; 104–107 cfu/g)", "medium—estimated to contain 104–107"]},
+    {"id": "unpeeled-produce", "query": "Do raw fruits and vegetables contain live microbes?",
+     "relevant": ["fruits and vegetables eaten unpeeled", "raw, unpeeled fruits and vegetables"]},
+    {"id": "kefir", "query": "Is kefir part of a healthy diet?",
+     "relevant": ["lower fat kefir", "yogurt, kefir, and sauerkraut"]},
+    {"id": "blood-pressure", "query": "Is eating live microbes linked to lower blood pressure?",
+     "relevant": ["lower systolic blood pressure"]},
+    {"id": "cognition", "query": "Live microbe intake and cognitive function in older adults",
+     "relevant": ["cognitive performance", "various cognitive domains"]},
+    {"id": "protein-foods", "query": "Which protein foods should be eaten more often?",
+     "relevant": ["among protein foods, consume plant-based more often"]},
+    {"id": "saturated-fat", "query": "What should replace foods high in saturated fat?",
+     "relevant": ["contain mostly unsaturated fat should replace foods"]},
+    {"id": "sugary-drinks", "query": "What should children drink instead of sugary drinks?",
+     "relevant": ["make water your drink of choice", "replace sugary drinks with water"]},
+    {"id": "sodium", "query": "Foods that contribute to excess sodium, sugars or saturated fat",
+     "relevant": ["excess sodium, free sugars, or saturated fat"]},
+    {"id": "food-skills", "query": "Cooking and food skills advice", "relevant": ["cook more often"]},
+    {"id": "breastfeeding", "query": "Feeding recommendations for infants", "relevant": ["breastfeeding"]},
+]
+
+# Defaults resolve from the repository root, so the benchmark runs from any directory
+REPO_ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+DEFAULT_KNOWLEDGE_DIR = os.path.join(REPO_ROOT, "knowledge")
+DEFAULT_WORK_DIR = os.path.join(REPO_ROOT, "output", "retrieval_benchmark")
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, "output", "retrieval_benchmark.jsonl")
+
+# Configurations compared by default: splitter settings x retriever
+CONFIGS = [
+    {"name": "dense-1000-200", "chunk_size": 1000, "chunk_overlap": 200, "retriever": "dense"},
+    {"name": "hybrid-1000-200", "chunk_size": 1000, "chunk_overlap": 200, "retriever": "hybrid"},
+    {"name": "dense-500-100", "chunk_size": 500, "chunk_overlap": 100, "retriever": "dense"},
+    {"name": "hybrid-500-100", "chunk_size": 500, "chunk_overlap": 100, "retriever": "hybrid"},
+    # Dense search on the NumPy index instead of Chroma: exact, IVF with int8 codes, IVF with PQ codes
+    {"name": "dense-numpy-flat", "chunk_size": 1000, "chunk_overlap": 200, "retriever": "dense",
+     "backend": "numpy", "index_options": {"index": "flat"}},
+    {"name": "dense-numpy-ivf-int8", "chunk_size": 1000, "chunk_overlap": 200, "retriever": "dense",
+     "backend": "numpy", "index_options": {"index": "ivf", "quantization": "int8", "nprobe": 8}},
+    {"name": "dense-numpy-ivf-pq", "chunk_size": 1000, "chunk_overlap": 200, "retriever": "dense",
+     "backend": "numpy", "index_options": {"index": "ivf", "quantization": "pq", "nprobe": 8}},
+]
+
+K_VALUES = (1, 4, 10)
+
+
+def normalize_text(text):
+    """Lowercase with runs of whitespace (PDF line breaks included) collapsed to one space."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def score_ranking(documents, phrases, k_values=K_VALUES):
+    """
+    Recall@k (share of the labeled phrases found in the top k) and reciprocal rank of the first relevant chunk.
+    """
+    phrases = [normalize_text(p) for p in phrases]
+    texts = [normalize_text(doc.page_content) for doc in documents]
+    found_at = {}
+    reciprocal_rank = 0.0
+    for rank, text in enumerate(texts, start=1):
+        matched = [p for p in phrases if p in text]
+        if matched and not reciprocal_rank:
+            reciprocal_rank = 1.0 / rank
+        for phrase in matched:
+            found_at.setdefault(phrase, rank)
+    recall = {k: sum(rank <= k for rank in found_at.values()) / len(phrases) for k in k_values}
+    return recall, reciprocal_rank
+
+
+def directory_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total / 2 ** 20
+
+
+def make_retriever(db, config, k):
+    """The retriever a configuration asks for, returning ``k`` documents."""
+    if config.get("retriever", "dense") == "dense":
+        return db.as_retriever(search_kwargs={"k": k})
+    reranker = CrossEncoderReranker(config["rerank_model"], budget_s=config.get("rerank_budget_s", 0.5)) \
+        if config.get("rerank_model") else None
+    return HybridRetriever.from_vectorstore(db, k=k, dense_k=config.get("dense_k", 20),
+                                            sparse_k=config.get("sparse_k", 20), reranker=reranker)
+
+
+def ann_recall(db, queries=QUERIES, k=10):
+    """Share of the exact top-``k`` chunks (by inner product over every stored vector) the vectorstore returns."""
+    stored = db.get(include=["embeddings"])
+    vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+    overlaps = []
+    for query in queries:
+        embedding = np.asarray(db.embeddings.embed_query(query["query"]), dtype=np.float32)
+        exact = {stored["ids"][i] for i in np.argsort(-(vectors @ embedding), kind="stable")[:k]}
+        found = {doc.id for doc in db.similarity_search(query["query"], k=k)}
+        overlaps.append(len(exact & found) / len(exact))
+    return float(np.mean(overlaps))
+
+
+def evaluate(retriever, queries=QUERIES, k_values=K_VALUES, repeats=3):
+    """Quality and latency of ``retriever`` over ``queries``; each query is timed ``repeats`` times after a warm-up."""
+    retriever.invoke(queries[0]["query"])
+    recalls = {k: [] for k in k_values}
+    reciprocal_ranks, latencies = [], []
+    per_query = {}
+    for query in queries:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            documents = retriever.invoke(query["query"])
+            latencies.append(time.perf_counter() - start)
+        recall, reciprocal_rank = score_ranking(documents, query["relevant"], k_values)
+        for k in k_values:
+            recalls[k].append(recall[k])
+        reciprocal_ranks.append(reciprocal_rank)
+        per_query[query["id"]] = {"recall": recall[max(k_values)], "rr": reciprocal_rank}
+    latencies_ms = np.asarray(latencies) * 1e3
+    return {**{f"recall@{k}": float(np.mean(v)) for k, v in recalls.items()},
+            "mrr": float(np.mean(reciprocal_ranks)),
+            "p50_ms": float(np.percentile(latencies_ms, 50)), "p95_ms": float(np.percentile(latencies_ms, 95)),
+            "per_query": per_query}
+
+
+def run_retrieval_benchmark(configs=CONFIGS, queries=QUERIES, knowledge_dir=DEFAULT_KNOWLEDGE_DIR,
+                            work_dir=DEFAULT_WORK_DIR, output_path=None, k_values=K_VALUES,
+                            repeats=3, cache_dir=None):
+    """
+    Build one vectorstore per configuration and measure its retrieval quality and cost.
+
+    Vectorstores are rebuilt from scratch under ``work_dir`` on CPU, so build
+    times are comparable; pass the embedding ``cache_dir`` to time rebuilds
+    with cached vectors instead. Configurations sharing splitter settings and
+    embedding model (and vectorstore backend) share one vectorstore.
+
+    Returns:
+        list: One record per configuration with recall@k, MRR, p50/p95 query latency (ms),
+        build time (s) and index size on disk (MB); dense configurations also get
+        ``ann_recall`` (overlap with the exact top k) and NumPy ones ``scanned_mb``
+        (codes and centroids a search reads). Also appended to ``output_path`` as JSONL.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    built = {}
+    results = []
+    for config in configs:
+        embedding_model = config.get("embedding_model", "BAAI/bge-small-en-v1.5")
+        backend = config.get("backend", "chroma")
+        store_key = (config["chunk_size"], config["chunk_overlap"], embedding_model)
+        if backend != "chroma":
+            store_key += (backend, *sorted(config.get("index_options", {}).items()))
+        if store_key not in built:
+            db_name = os.path.join(work_dir, "-".join(re.sub(r"[^A-Za-z0-9.]+", "_", str(p)) for p in store_key))
+            start = time.perf_counter()
+            db = create_vectorstore(db_name, knowledge_dir=knowledge_dir, force=True,
+                                    chunk_size=config["chunk_size"], chunk_overlap=config["chunk_overlap"],
+                                    embedding_model=embedding_model, device="cpu", cache_dir=cache_dir,
+                                    backend=backend, index_options=config.get("index_options"))
+            built[store_key] = (db, time.perf_counter() - start, directory_size_mb(db_name))
+        db, build_s, index_mb = built[store_key]
+
+        start = time.perf_counter()
+        retriever = make_retriever(db, config, max(k_values))
+        retriever_build_s = time.perf_counter() - start
+        metrics = evaluate(retriever, queries, k_values, repeats)
+        record = {"config": config["name"], **{key: value for key, value in config.items() if key != "name"},
+                  "chunks": document_count(db), "build_s": build_s + retriever_build_s, "index_mb": index_mb,
+                  **metrics}
+        if config.get("retriever", "dense") == "dense":
+            record["ann_recall"] = ann_recall(db, queries, max(k_values))
+        if isinstance(db, NumpyVectorStore):
+            record["scanned_mb"] = db.index_bytes() / 2 ** 20
+        results.append(record)
+        print(f"✅ {config['name']}: " + ", ".join(f"recall@{k} {record[f'recall@{k}']:.2f}" for k in k_values)
+              + f", MRR {record['mrr']:.2f}, p50 {record['p50_ms']:.1f}ms, p95 {record['p95_ms']:.1f}ms, "
+                f"build {record['build_s']:.1f}s, {index_mb:.1f}MB"
+              + (f", ANN recall {record['ann_recall']:.2f}" if "ann_recall" in record else "")
+              + (f", {record['scanned_mb']:.2f}MB scanned" if "scanned_mb" in record else ""))
+        if output_path:
+            with open(output_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency over the knowledge corpus")
+    parser.add_argument("--knowledge-dir", default=DEFAULT_KNOWLEDGE_DIR)
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--configs", nargs="+", default=[c["name"] for c in CONFIGS])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--embedding-cache", action="store_true", help="reuse cached vectors when building")
+    args = parser.parse_args()
+
+    # Offline: models must already be in the local Hugging Face cache
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    run_retrieval_benchmark([c for c in CONFIGS if c["name"] in args.configs], knowledge_dir=args.knowledge_dir,
+                            work_dir=args.work_dir, output_path=args.output, repeats=args.repeats,
+                            cache_dir=DEFAULT_CACHE_DIR if args.embedding_cache else None)
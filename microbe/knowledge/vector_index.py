@@ -0,0 +1,335 @@
+# Compact NumPy vector index (flat or IVF, optionally int8 / product quantized) behind the vectorstore interface
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from microbe import tracing
+
+# Bumped when the files written by NumpyVectorStore.persist change
+INDEX_VERSION = 1
+
+INDEX_FILE = "index.json"
+DOCUMENTS_FILE = "documents.json"
+
+INDEX_TYPES = ("flat", "ivf")
+QUANTIZATIONS = (None, "int8", "pq")
+
+# Product quantization: 256 centroids per subspace, so each subspace code is one byte
+PQ_CENTROIDS = 256
+DEFAULT_PQ_SUBVECTOR_DIM = 8
+
+# k-means for the IVF lists and PQ codebooks trains on at most this many vectors
+KMEANS_SAMPLE = 65536
+KMEANS_ITERATIONS = 20
+
+# Rows scored per block, bounding the float32 temporaries when scanning quantized codes
+SCAN_BLOCK_ROWS = 65536
+
+
+def nearest_centroids(vectors, centroids):
+    """Index of the nearest centroid (squared L2) of every row of ``vectors``."""
+    norms = (centroids * centroids).sum(axis=1)
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), SCAN_BLOCK_ROWS):
+        block = vectors[start:start + SCAN_BLOCK_ROWS]
+        assign[start:start + len(block)] = np.argmin(norms - 2 * block @ centroids.T, axis=1)
+    return assign
+
+
+def kmeans(vectors, k, iterations=KMEANS_ITERATIONS, seed=0):
+    """Lloyd's k-means on a sample of ``vectors``; empty clusters are re-seeded from random rows."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_SAMPLE:
+        vectors = vectors[np.sort(rng.choice(len(vectors), KMEANS_SAMPLE, replace=False))]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest_centroids(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        centroids[filled] = np.add.reduceat(vectors[order], starts, axis=0) / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vectorstore over NumPy arrays saved as ``.npy`` files and memory-mapped on load.
+
+    Vectors are compared by inner product (cosine for the normalized
+    embeddings of ``get_embedding_function``). The index is either ``flat``
+    (every vector is scored) or ``ivf`` (vectors are grouped into ``nlist``
+    k-means lists and only the ``nprobe`` lists closest to the query are
+    scored). Scored vectors can be stored as float32, ``int8`` (one byte per
+    dimension, scaled per dimension) or ``pq`` (one byte per ``pq_dim``
+    dimensions). Quantized scores are approximate, so the best ``rerank_k``
+    candidates are rescored from the float32 vectors, which stay on disk
+    and are only paged in for those rows.
+
+    Writes (``upsert``, ``delete``, ``add_texts``) are staged in memory; the
+    index is rebuilt on the next search and written to ``persist_directory``
+    by ``persist()``. An index loaded from disk keeps the ``index``,
+    ``quantization``, ``nlist`` and ``pq_dim`` it was built with.
+
+    Args:
+        embedding_function: Embeddings used for queries and ``add_texts``.
+        persist_directory (str): Folder holding the index files; loaded when present.
+        index (str): ``"flat"`` or ``"ivf"``.
+        quantization (str): None, ``"int8"`` or ``"pq"``.
+        nlist (int): IVF lists; default about 4 * sqrt(number of vectors).
+        nprobe (int): IVF lists scored per query.
+        pq_dim (int): Dimensions per PQ subvector (must divide the embedding size).
+        rerank_k (int): Quantized candidates rescored exactly; 0 keeps the quantized scores.
+    """
+
+    def __init__(self, embedding_function=None, persist_directory=None, index="flat", quantization=None, nlist=None,
+                 nprobe=8, pq_dim=DEFAULT_PQ_SUBVECTOR_DIM, rerank_k=50):
+        if index not in INDEX_TYPES:
+            raise ValueError(f"Unknown index '{index}', expected one of {INDEX_TYPES}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.options = {"index": index, "quantization": quantization, "nlist": nlist, "pq_dim": pq_dim}
+        self.nprobe = nprobe
+        self.rerank_k = rerank_k
+
+        self._ids, self._texts, self._metadatas = [], [], []
+        # Document id -> row of the built index, for get(ids=...)
+        self._rows = {}
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._arrays = {}
+        self._staged = None
+        if persist_directory and os.path.exists(os.path.join(persist_directory, INDEX_FILE)):
+            self._load()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    # --- Persistence -------------------------------------------------------------------------------
+
+    def _load(self):
+        with open(os.path.join(self.persist_directory, INDEX_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Index at {self.persist_directory} has version {meta.get('version')}, "
+                             f"expected {INDEX_VERSION}; rebuild it")
+        self.options = meta["options"]
+        with open(os.path.join(self.persist_directory, DOCUMENTS_FILE), encoding="utf-8") as f:
+            documents = json.load(f)
+        self._ids, self._texts, self._metadatas = documents["ids"], documents["texts"], documents["metadatas"]
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._vectors = np.load(os.path.join(self.persist_directory, "vectors.npy"), mmap_mode="r")
+        self._arrays = {name: np.load(os.path.join(self.persist_directory, f"{name}.npy"), mmap_mode="r")
+                        for name in meta["arrays"]}
+
+    def persist(self):
+        """Build the index if writes are staged and save it to ``persist_directory``."""
+        index_path = os.path.join(self.persist_directory, INDEX_FILE)
+        if self._staged is None and os.path.exists(index_path):
+            return
+        self._build()
+        os.makedirs(self.persist_directory, exist_ok=True)
+        # Each file is written next to its target and renamed over it: open memory maps keep reading the old one
+        for name, array in {"vectors": self._vectors, **self._arrays}.items():
+            path = os.path.join(self.persist_directory, f"{name}.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(path + ".tmp", path)
+        self._write_json(DOCUMENTS_FILE, {"ids": self._ids, "texts": self._texts, "metadatas": self._metadatas})
+        # Written last, so a folder without it is never loaded half-written
+        self._write_json(INDEX_FILE, {"version": INDEX_VERSION, "options": self.options, "count": len(self._ids),
+                                      "dimensions": int(self._vectors.shape[1]), "arrays": sorted(self._arrays)})
+        self._load()
+
+    def _write_json(self, name, data):
+        path = os.path.join(self.persist_directory, name)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def delete_index(persist_directory):
+        if os.path.exists(persist_directory):
+            shutil.rmtree(persist_directory)
+
+    def index_bytes(self):
+        """Bytes scanned by searches: the codes (or vectors) plus IVF centroids and PQ codebooks."""
+        self._build()
+        scanned = self._arrays.get("codes", self._vectors)
+        return int(scanned.nbytes + sum(a.nbytes for name, a in self._arrays.items() if name != "codes"))
+
+    # --- Writes ------------------------------------------------------------------------------------
+
+    def _stage(self):
+        """Switch to an editable ``{id: (text, metadata, vector)}`` copy of the stored rows."""
+        if self._staged is None:
+            self._staged = {i: (t, m, np.asarray(v, dtype=np.float32))
+                            for i, t, m, v in zip(self._ids, self._texts, self._metadatas, self._vectors)}
+        return self._staged
+
+    def upsert(self, ids, embeddings, documents, metadatas=None):
+        staged = self._stage()
+        for i, (doc_id, vector, text) in enumerate(zip(ids, embeddings, documents)):
+            staged[doc_id] = (text, (metadatas[i] if metadatas else None) or {}, np.asarray(vector, dtype=np.float32))
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self.upsert(ids, self.embedding_function.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        staged = self._stage()
+        for doc_id in ids or []:
+            staged.pop(doc_id, None)
+        return True
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    # --- Index build -------------------------------------------------------------------------------
+
+    def _build(self):
+        if self._staged is None:
+            return
+        staged, self._staged = self._staged, None
+        self._ids = list(staged)
+        self._texts = [text for text, _, _ in staged.values()]
+        self._metadatas = [metadata for _, metadata, _ in staged.values()]
+        vectors = np.stack([v for _, _, v in staged.values()]) if staged else np.zeros((0, 0), dtype=np.float32)
+        arrays = {}
+        with tracing.span("index.build", vectors=len(vectors), **{k: v for k, v in self.options.items() if v}):
+            if self.options["index"] == "ivf" and len(vectors):
+                nlist = self.options["nlist"] or max(1, int(4 * np.sqrt(len(vectors))))
+                centroids = kmeans(vectors, nlist)
+                assign = nearest_centroids(vectors, centroids)
+                # Rows sorted by list, so each list is one contiguous range
+                order = np.argsort(assign, kind="stable")
+                vectors = vectors[order]
+                self._ids = [self._ids[i] for i in order]
+                self._texts = [self._texts[i] for i in order]
+                self._metadatas = [self._metadatas[i] for i in order]
+                arrays["centroids"] = centroids
+                arrays["list_offsets"] = np.concatenate(
+                    [[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))]).astype(np.int64)
+
+            if self.options["quantization"] == "int8" and len(vectors):
+                scale = np.abs(vectors).max(axis=0) / 127
+                scale[scale == 0] = 1.0
+                arrays["scale"] = scale.astype(np.float32)
+                arrays["codes"] = np.round(vectors / scale).astype(np.int8)
+            elif self.options["quantization"] == "pq" and len(vectors):
+                dims = vectors.shape[1]
+                sub = self.options["pq_dim"]
+                if dims % sub:
+                    raise ValueError(f"pq_dim {sub} does not divide the embedding size {dims}")
+                subvectors = vectors.reshape(len(vectors), dims // sub, sub)
+                codebooks = np.zeros((dims // sub, PQ_CENTROIDS, sub), dtype=np.float32)
+                codes = np.empty((len(vectors), dims // sub), dtype=np.uint8)
+                for m in range(dims // sub):
+                    centroids = kmeans(subvectors[:, m], PQ_CENTROIDS, seed=m)
+                    codebooks[m, :len(centroids)] = centroids
+                    codes[:, m] = nearest_centroids(subvectors[:, m], centroids)
+                arrays["codebooks"] = codebooks
+                arrays["codes"] = codes
+        self._vectors = vectors
+        self._arrays = arrays
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+
+    # --- Search ------------------------------------------------------------------------------------
+
+    def _candidate_rows(self, query, nprobe):
+        if self.options["index"] != "ivf":
+            return None
+        offsets = self._arrays["list_offsets"]
+        lists = np.argsort(-(self._arrays["centroids"] @ query))[:nprobe]
+        return np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in lists])
+
+    def _scores(self, query, rows):
+        """Approximate (quantized) or exact scores of ``rows`` (all rows when None)."""
+        quantization = self.options["quantization"]
+        source = self._arrays["codes"] if quantization else self._vectors
+        n = len(source) if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        if quantization == "pq":
+            codebooks = self._arrays["codebooks"]
+            tables = np.einsum("mcs,ms->mc", codebooks, query.reshape(len(codebooks), -1))
+            subspaces = np.arange(len(codebooks))
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            block = source[start:start + SCAN_BLOCK_ROWS] if rows is None else source[rows[start:start + SCAN_BLOCK_ROWS]]
+            if quantization == "pq":
+                scores[start:start + len(block)] = tables[subspaces, block].sum(axis=1)
+            elif quantization == "int8":
+                scores[start:start + len(block)] = block.astype(np.float32) @ (query * self._arrays["scale"])
+            else:
+                scores[start:start + len(block)] = block @ query
+        return scores
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, nprobe=None, rerank_k=None):
+        """``(document, inner product)`` pairs of the ``k`` best rows, best first."""
+        self._build()
+        if not len(self._ids):
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        rows = self._candidate_rows(query, nprobe or self.nprobe)
+        scores = self._scores(query, rows)
+        rows = np.arange(len(scores)) if rows is None else rows
+
+        rerank_k = self.rerank_k if rerank_k is None else rerank_k
+        shortlist = max(k, rerank_k) if self.options["quantization"] and rerank_k else k
+        top = np.argpartition(-scores, min(shortlist, len(scores)) - 1)[:shortlist]
+        rows, scores = rows[top], scores[top]
+        if self.options["quantization"] and rerank_k:
+            order = np.argsort(rows)
+            rows, scores = rows[order], np.asarray(self._vectors[rows[order]]) @ query
+        best = np.lexsort((rows, -scores))[:k]
+        return [(Document(id=self._ids[i], page_content=self._texts[i], metadata=dict(self._metadatas[i] or {})),
+                 float(s)) for i, s in zip(rows[best], scores[best])]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        with tracing.span("index.embed_query"):
+            embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # Inner product of normalized vectors, mapped from [-1, 1] to [0, 1]
+        return lambda score: (score + 1) / 2
+
+    # --- Chroma-compatible helpers ----------------------------------------------------------------
+
+    def count(self):
+        return len(self._staged) if self._staged is not None else len(self._ids)
+
+    def get(self, ids=None, include=("documents", "metadatas")):
+        """Stored rows in the layout of ``Chroma.get``: ``{"ids", "documents", "metadatas"}``."""
+        self._build()
+        rows = range(len(self._ids)) if ids is None else [self._rows[i] for i in ids if i in self._rows]
+        result = {"ids": [self._ids[i] for i in rows]}
+        if "documents" in include:
+            result["documents"] = [self._texts[i] for i in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self._metadatas[i] for i in rows]
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(self._vectors[list(rows)])
+        return result
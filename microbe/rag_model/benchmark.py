@@ -0,0 +1,315 @@
+# Benchmark runner for the model x prompt x recall matrix of the diet notebooks
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from microbe import tracing
+from microbe.rag_model.diet_tools import make_tools
+from microbe.rag_model.response_cache import ResponseCache
+from microbe.rag_model.simple_diet_model import SimpleDietModel, final_response
+
+# Paths of the notebooks' vectorstore, knowledge base and the sweep output, from the repository root
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+DEFAULT_DB_NAME = os.path.normpath(os.path.join(REPO_ROOT, "diet_vector_db"))
+DEFAULT_KNOWLEDGE_DIR = os.path.normpath(os.path.join(REPO_ROOT, "knowledge"))
+DEFAULT_OUTPUT = os.path.normpath(os.path.join(REPO_ROOT, "output", "benchmark.jsonl"))
+
+MODELS = ["llama3.2:1b", "llama3.2:3b", "granite3-dense:2b", "granite3-dense:8b", "mistral", "gemma3:1b", "gemma3:4b",
+          "gemma3:27b"]
+
+SYSTEM_PROMPT = """
+You are a nutrition assistant that helps modify dietary recalls to better meet user goals.
+
+**Always follow these steps:**
+1. Use `GuidelineRetriever` to identify foods high in live microbes.
+2. Use `FoodSelector` to confirm those candidate foods exist in the Canadian Nutrient File (CNF).
+3. Use `NutrientCalculator` to evaluate the nutrient impact of replacing foods.
+4. Make no more than 2–3 substitutions, and explain your reasoning.
+
+**Always return:**
+- A table showing before and after
+- An explanation of the live microbe benefit and nutritional equivalence
+- Only food items that exist in CNF
+"""
+
+# "{recall}" is replaced by the recall items
+USER_PROMPT = """
+A 6-year-old Canadian child provided the following dietary recall for consuming the following food items (food_identifier in NutrientCalculator) in the given quantities (amount in NutrientCalculator) in grams (measure_search_name in NutrientCalculator) for a day:
+{
+{recall}
+}.
+
+Recommend what food items should be swapped with what so that the child's includes more live microbe foods, but the energy intake remains the same.
+Present side by side the complete recalls (original and with modifications) in table format.
+"""
+
+RECALL = """Butter, regular:9.46,
+Bread, egg, (challah), toasted:74,
+Peanut butter, smooth type, fat, sugar and salt added:16,
+Sweets, honey, strained or extracted:21,
+Water, mineral, "POLAND SPRINGS", bottled:284.16,
+Grape, red or green (European type, such as Thompson seedless), adherent skin, raw:113.25,
+Deli-meat, pepperoni:102,
+Cracker, standard snack-type:31,
+Deli-meat, pepperoni:89.25,
+Fruit juice blend, 100% juice, with added Vitamin C:262.08,
+Cookie, chocolate sandwich, cream filling, regular:8.4,
+Endive, chicory, escarole, or romaine, raw:7.5,
+Pork, cured, bacon, cooked, pan-fried:5,
+Salad dressing, caesar dressing, regular:2.45,
+Chicken, breast, with or without bone, roasted, skin not eaten:56,
+Popcorn, air-popped, buttered:26,Orange juice, chilled, includes from concentrate:14.4"""
+
+PROMPTS = [{"id": "live-microbes", "system": SYSTEM_PROMPT, "user": USER_PROMPT}]
+RECALLS = [{"id": "child-6y", "items": RECALL}]
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Offline stand-in for an Ollama chat model.
+
+    Sleeps ``latency`` seconds per call, calls the first bound tool once per
+    conversation (with ``tool_input``), then answers ``answer``. Reports token
+    usage as whitespace-separated words, so the runner can be exercised end to
+    end without a model server. When streamed, the answer arrives word by
+    word, ``token_latency`` seconds apart.
+    """
+
+    answer: str = "| Original | Modified |\n|---|---|\n| Butter, regular | Yogurt, plain |"
+    tool_input: str = "yogurt"
+    latency: float = 0.0
+    token_latency: float = 0.0
+    tool_names: list = []
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tool_names": [tool.name for tool in tools]})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        if self.tool_names and not any(isinstance(m, ToolMessage) for m in messages):
+            message = AIMessage(content="", tool_calls=[
+                {"name": self.tool_names[0], "args": {"__arg1": self.tool_input}, "id": "call_0"}])
+        else:
+            message = AIMessage(content=self.answer)
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        output_tokens = len(message.content.split()) + len(message.tool_calls)
+        message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                  "total_tokens": input_tokens + output_tokens}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._generate(messages, stop, run_manager, **kwargs).generations[0].message
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="", tool_call_chunks=[{"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"],
+                                               "index": i} for i, c in enumerate(message.tool_calls)],
+                usage_metadata=message.usage_metadata))
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.token_latency)
+            chunk = AIMessageChunk(content=word if i == 0 else " " + word,
+                                   usage_metadata=message.usage_metadata if i == 0 else None)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+
+def build_messages(prompt, recall):
+    return [SystemMessage(content=prompt["system"]),
+            HumanMessage(content=prompt["user"].replace("{recall}", recall["items"]))]
+
+
+def run_key(model_id, prompt_id, recall_id, repeat):
+    return f"{model_id}|{prompt_id}|{recall_id}|{repeat}"
+
+
+def load_checkpoint(path):
+    """Records already in the JSONL checkpoint, by run key; a truncated last line is ignored."""
+    records = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record["key"]] = record
+    return records
+
+
+def usage_summary(messages):
+    """Token usage, LLM calls and tool calls over the messages of one run."""
+    usage = Counter()
+    tools = Counter()
+    llm_calls = 0
+    for message in messages:
+        if isinstance(message, AIMessage):
+            llm_calls += 1
+            for name in ("input_tokens", "output_tokens", "total_tokens"):
+                usage[name] += (message.usage_metadata or {}).get(name, 0)
+            tools.update(call["name"] for call in message.tool_calls)
+    return {**{name: usage[name] for name in ("input_tokens", "output_tokens", "total_tokens")},
+            "llm_calls": llm_calls, "tool_calls": sum(tools.values()), "tools_used": dict(tools)}
+
+
+async def run_once(diet_model, messages, use_response_cache=False):
+    """
+    Invoke the agent once and time it; failures are recorded, not raised.
+
+    Runs bypass the model's ``response_cache`` unless ``use_response_cache``;
+    a cached response is recorded with ``cached: True`` and no usage.
+    """
+    start = time.perf_counter()
+    try:
+        response = await asyncio.to_thread(diet_model.cached_response, messages, use_response_cache)
+        if response is not None:
+            return {"status": "ok", "latency_s": time.perf_counter() - start, **usage_summary([]),
+                    "response": response, "cached": True, "error": None}
+        state = await diet_model.ainvoke_app(messages)
+    except Exception as e:
+        return {"status": "error", "latency_s": time.perf_counter() - start, "error": f"{type(e).__name__}: {e}"}
+    latency = time.perf_counter() - start
+    new_messages = state["messages"][len(messages):]
+    response = final_response(new_messages)
+    await asyncio.to_thread(diet_model.cache_response, messages, response, use_response_cache)
+    return {"status": "ok", "latency_s": latency, **usage_summary(new_messages), "response": response,
+            "cached": False, "error": None}
+
+
+async def run_benchmark_async(make_model, output_path, models=MODELS, prompts=PROMPTS, recalls=RECALLS, repeats=1,
+                              concurrency=2, retry_errors=False, trace_dir=None, use_response_cache=False):
+    """
+    Run every (model, prompt, recall, repeat) combination and append one JSON record per run to ``output_path``.
+
+    Models run one after another; the runs of a model share one ``SimpleDietModel``
+    from ``make_model(model_id)``, warmed up before the first timed run, and at
+    most ``concurrency`` of them are in flight at once on the event loop. Runs already in the file
+    are skipped, so an interrupted sweep resumes where it stopped.
+
+    With ``trace_dir``, tracing is turned on: each run writes its spans to a
+    trace file there (named after its key), and the latency histograms of all
+    spans go to ``histograms.json`` at the end.
+
+    Runs skip the models' response caches, so every run reaches the model;
+    ``use_response_cache=True`` serves and stores them through the cache instead.
+
+    Returns:
+        list: All records of the sweep, previous runs included.
+    """
+    done = load_checkpoint(output_path)
+    if retry_errors:
+        done = {key: record for key, record in done.items() if record["status"] == "ok"}
+    semaphore = asyncio.Semaphore(concurrency)
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+        tracing.enable()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "a+", encoding="utf-8") as checkpoint:
+        # Terminate a line cut short by an interrupted sweep before appending
+        if checkpoint.tell() > 0:
+            checkpoint.seek(checkpoint.tell() - 1)
+            if checkpoint.read(1) != "\n":
+                checkpoint.write("\n")
+
+        async def run(diet_model, model_id, prompt, recall, repeat, warm_up_s):
+            key = run_key(model_id, prompt["id"], recall["id"], repeat)
+            async with semaphore:
+                with tracing.trace_run(key) as trace:
+                    result = await run_once(diet_model, build_messages(prompt, recall), use_response_cache)
+            if trace_dir:
+                trace_file = os.path.join(trace_dir, re.sub(r"[^A-Za-z0-9._-]+", "_", key) + ".json")
+                result["trace_file"] = trace.export(trace_file)
+            record = {"key": key, "model": model_id, "prompt": prompt["id"], "recall": recall["id"],
+                      "repeat": repeat, "warm_up_s": warm_up_s, "finished_at": datetime.now().isoformat(), **result}
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            done[key] = record
+            print(f"{'✅' if record['status'] == 'ok' else '❌'} {key}: {record['latency_s']:.2f}s, "
+                  f"{record.get('total_tokens', 0)} tokens, {record.get('tool_calls', 0)} tool calls"
+                  f"{' (cached)' if record.get('cached') else ''}")
+
+        for model_id in models:
+            pending = [(prompt, recall, repeat) for prompt in prompts for recall in recalls for repeat in range(repeats)
+                       if run_key(model_id, prompt["id"], recall["id"], repeat) not in done]
+            if not pending:
+                continue
+            diet_model = make_model(model_id)
+            warm_up_s = await asyncio.to_thread(diet_model.warm_up)
+            print(f"🔥 {model_id} warmed up in {warm_up_s:.2f}s, {len(pending)} runs to go")
+            await asyncio.gather(*(run(diet_model, model_id, *args, warm_up_s) for args in pending))
+
+    if trace_dir:
+        tracing.export_histograms(os.path.join(trace_dir, "histograms.json"))
+    return list(done.values())
+
+
+def run_benchmark(make_model, output_path, **kwargs):
+    """Blocking wrapper around ``run_benchmark_async``."""
+    return asyncio.run(run_benchmark_async(make_model, output_path, **kwargs))
+
+
+def ollama_model_factory(db_name=DEFAULT_DB_NAME, knowledge_dir=DEFAULT_KNOWLEDGE_DIR, response_cache=None):
+    """
+    ``make_model`` for ``run_benchmark`` with the notebook's setup: Ollama models
+    with the CNF tools and the hybrid guideline retriever over ``db_name``
+    (created or updated from ``knowledge_dir`` first). The tools and retriever
+    are built once and shared by every model; tool results are not cached,
+    so repeats of a run do the same work.
+    """
+    from microbe.knowledge.hybrid_retriever import DEFAULT_RERANK_MODEL, create_hybrid_retriever
+    from microbe.knowledge.prepare_vectorstore import create_vectorstore
+
+    db = create_vectorstore(db_name, knowledge_dir=knowledge_dir, force=False)
+    retriever = create_hybrid_retriever(db, k=4, dense_k=20, sparse_k=20, rerank_model=DEFAULT_RERANK_MODEL,
+                                        rerank_budget_s=0.5)
+    tools = make_tools(retriever)
+
+    def make_model(model_id):
+        return SimpleDietModel(model_id, "ollama", retriever=retriever, tools=tools, response_cache=response_cache)
+    return make_model
+
+
+def stub_model_factory(latency=0.0, tools=None, response_cache=None):
+    """``make_model`` for ``run_benchmark`` backed by ``StubChatModel`` instead of Ollama."""
+    def make_model(model_id):
+        return SimpleDietModel(model_id, "stub", retriever=None, tools=tools or [],
+                               llm=StubChatModel(latency=latency), response_cache=response_cache)
+    return make_model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the diet model benchmark sweep")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--stub", action="store_true", help="use StubChatModel instead of Ollama")
+    parser.add_argument("--db-name", default=DEFAULT_DB_NAME, help="guideline vectorstore (created if missing)")
+    parser.add_argument("--knowledge-dir", default=DEFAULT_KNOWLEDGE_DIR)
+    parser.add_argument("--trace-dir", help="write a trace file per run and span histograms here")
+    parser.add_argument("--response-cache", help="serve repeated prompts from this SQLite response cache "
+                                                 "(exact repeats only; runs served from it are not model timings)")
+    args = parser.parse_args()
+
+    response_cache = ResponseCache(persist_path=args.response_cache) if args.response_cache else None
+    if args.stub:
+        factory = stub_model_factory(latency=0.1, response_cache=response_cache)
+    else:
+        factory = ollama_model_factory(args.db_name, args.knowledge_dir, response_cache)
+    run_benchmark(factory, args.output, models=args.models, repeats=args.repeats, concurrency=args.concurrency,
+                  trace_dir=args.trace_dir, use_response_cache=response_cache is not None)
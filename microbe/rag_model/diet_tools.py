@@ -0,0 +1,76 @@
+# The agent tools of the diet notebooks: CNF nutrient tools plus the guideline retriever
+import asyncio
+
+from langchain_core.tools import Tool
+
+from microbe.cnf_api import nutrient_calculator
+
+
+def guideline_retriever_tools(retriever):
+    """``(func, coroutine)`` returning the guideline excerpts ``retriever`` finds for a query."""
+    def guideline_retriever_tool(input_str: str) -> str:
+        """
+        Input: user goal or phrase (e.g., "foods high in live microbes")
+        Returns: text excerpts from vectorstore.
+        """
+        try:
+            results = retriever.get_relevant_documents(input_str.strip())
+            return "📘 Relevant guideline excerpts:\n" + "\n".join([doc.page_content for doc in results])
+        except Exception as e:
+            return f"❌ Error retrieving guidelines: {str(e)}"
+
+    async def aguideline_retriever_tool(input_str: str) -> str:
+        return await asyncio.to_thread(guideline_retriever_tool, input_str)
+
+    return guideline_retriever_tool, aguideline_retriever_tool
+
+
+def make_tools(retriever, cache=None, guideline_version=None):
+    """
+    The notebook's tool list: NutrientCalculator, RecallNutrientCalculator, FoodSelector, FoodSubstitution
+    and GuidelineRetriever over ``retriever``.
+
+    Args:
+        retriever: Retriever of guideline passages (e.g. from ``create_hybrid_retriever``).
+        cache: Optional ``ToolCache``; CNF tools are invalidated when the CNF data changes.
+        guideline_version: Callable versioning the cached GuidelineRetriever results, e.g.
+            ``lambda: vectorstore_version(db_name)``; without it they are cached for ``cache.ttl``.
+    """
+    def cached(func, coroutine, name, version=None):
+        if cache is None:
+            return {"func": func, "coroutine": coroutine}
+        return {"func": cache.wrap(func, name, version=version), "coroutine": cache.awrap(coroutine, name, version=version)}
+
+    cnf_version = nutrient_calculator.cnf_data_version
+    guideline_tool, aguideline_tool = guideline_retriever_tools(retriever)
+    return [
+        Tool(
+            name="NutrientCalculator",
+            **cached(nutrient_calculator.nutrient_calculator_tool, nutrient_calculator.anutrient_calculator_tool,
+                     "NutrientCalculator", cnf_version),
+            description="Use this when you need to compute calories, macronutrients, or nutrient content for a food item and its quantity (e.g., 'Butter, regular | 9.46g'). Always use this after proposing a modification."
+        ),
+        Tool(
+            name="RecallNutrientCalculator",
+            func=nutrient_calculator.recall_nutrient_calculator_tool,
+            coroutine=nutrient_calculator.arecall_nutrient_calculator_tool,
+            description="Use this to compute nutrients for a whole dietary recall in one call. Input is one 'food | grams' item per line or separated by ';' (e.g., 'Butter, regular | 9.46g; Deli-meat, pepperoni | 102g'). Returns per-item nutrients and day totals."
+        ),
+        Tool(
+            name="FoodSelector",
+            **cached(nutrient_calculator.food_selector_tool, nutrient_calculator.afood_selector_tool,
+                     "FoodSelector", cnf_version),
+            description="Use this to verify if a food exists in the CNF before recommending it. Input should be a food name like 'Almond butter'.. You must use it before suggesting any food substitution."
+        ),
+        Tool(
+            name="FoodSubstitution",
+            **cached(nutrient_calculator.food_substitution_tool, nutrient_calculator.afood_substitution_tool,
+                     "FoodSubstitution", cnf_version),
+            description="Use this to find CNF foods that can replace a food portion with roughly the same nutrition, instead of guessing candidates one by one. Input is 'food | grams', optionally followed by '| live microbes', '| same group' or '| group: <food group>' (e.g., 'Deli-meat, pepperoni | 102g | live microbes'). Returns the closest foods with the portion that matches the original's energy."
+        ),
+        Tool(
+            name="GuidelineRetriever",
+            **cached(guideline_tool, aguideline_tool, "GuidelineRetriever", guideline_version),
+            description="Use this to find foods high in live microbes when the user asks to increase such foods. Input can be a user goal or phrase like 'live microbe foods for kids'."
+        ),
+    ]
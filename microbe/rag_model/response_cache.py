@@ -0,0 +1,211 @@
+# Semantic cache of final agent responses, keyed by model, prompt and user message
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.messages import HumanMessage
+
+from microbe import tracing
+from microbe.rag_model.tool_cache import normalize_argument
+
+# Cosine similarity two user messages need to share a response; the recall
+# prompts differ in a few food names, so anything lower mixes up recalls
+DEFAULT_SIMILARITY_THRESHOLD = 0.97
+
+NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+def prompt_hash(model_id, messages):
+    """Hash of the model and of every message before the user message (system prompt and earlier turns)."""
+    digest = hashlib.sha256(model_id.encode("utf-8"))
+    for message in messages:
+        digest.update(f"\0{message.type}\0{message.content}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def split_messages(messages):
+    """``(context, user text)``: the messages before the last ``HumanMessage``, and its content (None if absent)."""
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage) and isinstance(messages[i].content, str):
+            return messages[:i], messages[i].content
+    return messages, None
+
+
+class ResponseCache:
+    """
+    LRU cache of final responses, matched exactly or by user-message embedding.
+
+    Entries are grouped by ``prompt_hash`` (model id, system prompt and any
+    earlier turns), so a response is only reused for the same model and
+    instructions. Within a group, a user message that matches a cached one
+    after ``normalize_argument`` is served without embedding anything;
+    otherwise, when an ``embedding_function`` is set, the cached message
+    with the highest cosine similarity is served if it reaches ``threshold``.
+    Dietary recalls that differ only in their quantities embed almost
+    identically, so with ``match_numbers`` a near-duplicate must also
+    contain the same numbers. The on-disk tier is a SQLite file holding
+    the same entries as memory, so it stays bounded by ``max_size`` too.
+
+    Args:
+        embedding_function: ``Embeddings`` for user messages (e.g. ``get_embedding_function()``);
+            None caches exact repeats only.
+        threshold (float): Minimum cosine similarity of a near-duplicate.
+        max_size (int): Entries kept before evicting the least recently used.
+        ttl (float): Seconds an entry stays valid, or ``None`` to keep it until evicted.
+        persist_path (str): SQLite file for the entries, or ``None`` for memory only.
+        match_numbers (bool): Near-duplicates must contain the same numbers as the message.
+    """
+
+    def __init__(self, embedding_function=None, threshold=DEFAULT_SIMILARITY_THRESHOLD, max_size=1024, ttl=None,
+                 persist_path=None, match_numbers=True):
+        self.embedding_function = embedding_function
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.match_numbers = match_numbers
+        # (namespace, key) -> {"numbers", "vector", "response", "created"}, least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache (namespace TEXT, key TEXT, numbers TEXT, vector BLOB, "
+                "response TEXT, created REAL, used REAL, PRIMARY KEY (namespace, key))")
+            self._db.commit()
+            self._load()
+        self.reset_stats()
+
+    def _load(self):
+        rows = self._db.execute(
+            "SELECT namespace, key, numbers, vector, response, created FROM response_cache "
+            "ORDER BY used DESC LIMIT ?", (self.max_size,)).fetchall()
+        for namespace, key, numbers, vector, response, created in reversed(rows):
+            self._entries[(namespace, key)] = {
+                "numbers": numbers, "response": response, "created": created,
+                "vector": np.frombuffer(vector, dtype=np.float32) if vector is not None else None}
+
+    def reset_stats(self):
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0, "evictions": 0,
+                      "hit_seconds": 0.0}
+
+    def summary(self):
+        """Hit rate and mean hit latency on top of the raw counters."""
+        stats = dict(self.stats)
+        hits = stats["hits"] + stats["semantic_hits"]
+        lookups = hits + stats["misses"]
+        stats["size"] = len(self._entries)
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        stats["mean_hit_ms"] = 1000 * stats["hit_seconds"] / hits if hits else 0.0
+        return stats
+
+    def _numbers(self, text):
+        return " ".join(NUMBER_PATTERN.findall(text)) if self.match_numbers else ""
+
+    def _embed(self, text):
+        if self.embedding_function is None:
+            return None
+        with tracing.span("response_cache.embed"):
+            vector = np.asarray(self.embedding_function.embed_query(text), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _valid(self, entry):
+        return self.ttl is None or time.time() - entry["created"] < self.ttl
+
+    def _touch(self, entry_key):
+        self._entries.move_to_end(entry_key)
+        if self._db is not None:
+            self._db.execute("UPDATE response_cache SET used = ? WHERE namespace = ? AND key = ?",
+                             (time.time(), *entry_key))
+            self._db.commit()
+
+    def _nearest(self, namespace, numbers, vector):
+        """Key of the most similar valid entry of ``namespace`` at or above the threshold, or None."""
+        keys, vectors = [], []
+        for entry_key, entry in self._entries.items():
+            if entry_key[0] == namespace and entry["vector"] is not None and entry["numbers"] == numbers \
+                    and self._valid(entry):
+                keys.append(entry_key)
+                vectors.append(entry["vector"])
+        if not keys:
+            return None
+        similarity = np.stack(vectors) @ vector
+        best = int(np.argmax(similarity))
+        return keys[best] if similarity[best] >= self.threshold else None
+
+    def lookup(self, model_id, messages):
+        """
+        Cached response for ``messages`` sent to ``model_id``, or None.
+
+        Returns:
+            str: The response of the same or a near-duplicate request; None on a miss.
+        """
+        start = time.perf_counter()
+        context, text = split_messages(messages)
+        if text is None:
+            return None
+        entry_key = (prompt_hash(model_id, context), normalize_argument(text))
+        with tracing.span("response_cache.lookup") as span:
+            with self._lock:
+                entry = self._entries.get(entry_key)
+                tier = "hits" if entry is not None and self._valid(entry) else None
+            if tier is None and self.embedding_function is not None:
+                # Embedded outside the lock, so other sessions' exact hits don't wait on the model
+                vector = self._embed(text)
+                with self._lock:
+                    entry_key = self._nearest(entry_key[0], self._numbers(text), vector)
+                tier = "semantic_hits" if entry_key is not None else None
+            span.set(result=tier or "miss")
+            with self._lock:
+                if tier is None or entry_key not in self._entries:
+                    self.stats["misses"] += 1
+                    return None
+                self._touch(entry_key)
+                self.stats[tier] += 1
+                self.stats["hit_seconds"] += time.perf_counter() - start
+                return self._entries[entry_key]["response"]
+
+    def store(self, model_id, messages, response):
+        """Cache ``response`` to ``messages``; empty responses (failed runs) are not cached."""
+        context, text = split_messages(messages)
+        if text is None or not response:
+            return
+        entry_key = (prompt_hash(model_id, context), normalize_argument(text))
+        vector = self._embed(text)
+        now = time.time()
+        with self._lock:
+            self._entries[entry_key] = {"numbers": self._numbers(text), "vector": vector, "response": response,
+                                        "created": now}
+            self._entries.move_to_end(entry_key)
+            evicted = []
+            while len(self._entries) > self.max_size:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self.stats["evictions"] += 1
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (*entry_key, self._numbers(text), vector.tobytes() if vector is not None else None,
+                                  response, now, now))
+                self._db.executemany("DELETE FROM response_cache WHERE namespace = ? AND key = ?", evicted)
+                self._db.commit()
+
+    def bypass(self):
+        """Count a request that skipped the cache (``use_cache=False``)."""
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def invalidate(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM response_cache")
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
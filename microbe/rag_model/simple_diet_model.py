@@ -1,6 +1,12 @@
+import asyncio
+import statistics
+import threading
+import time
 from typing import Annotated, TypedDict
 
 from langchain.agents import AgentExecutor
+from langchain.chat_models import init_chat_model
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
 from langchain_ollama import OllamaLLM
 from langchain_core.tools import Tool
@@ -9,12 +15,163 @@ from langgraph.prebuilt import create_react_agent
 from langgraph.graph import StateGraph
 from langchain_core.runnables import RunnableLambda
 
+from microbe import tracing
+
+# How long Ollama keeps a model loaded after a request, so a sweep doesn't reload it
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Chat model clients shared by every SimpleDietModel, keyed by (provider, model_id)
+_chat_models = {}
+_chat_models_lock = threading.Lock()
+
+
+def get_chat_model(model_provider, model_id):
+    """Return the shared chat model client for a provider and model, creating it on first use."""
+    key = (model_provider, model_id)
+    with _chat_models_lock:
+        if key not in _chat_models:
+            kwargs = {"keep_alive": OLLAMA_KEEP_ALIVE} if model_provider == "ollama" else {}
+            _chat_models[key] = init_chat_model(model_id, model_provider=model_provider, **kwargs)
+        return _chat_models[key]
+
+
+class StreamMetrics:
+    """
+    Latency of one streamed run: time to first token, gaps between tokens and wall time per graph node.
+
+    All times are in seconds from the start of the run.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.token_times = []
+        self.node_seconds = {}
+        self.total_seconds = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def add_token(self):
+        self.token_times.append(self.elapsed())
+
+    def add_node(self, node, seconds):
+        self.node_seconds[node] = self.node_seconds.get(node, 0.0) + seconds
+
+    @property
+    def time_to_first_token(self):
+        return self.token_times[0] if self.token_times else None
+
+    @property
+    def inter_token_latencies(self):
+        return [b - a for a, b in zip(self.token_times, self.token_times[1:])]
+
+    def summary(self):
+        gaps = self.inter_token_latencies
+        return {
+            "ttft_s": self.time_to_first_token,
+            "tokens": len(self.token_times),
+            "inter_token_mean_s": statistics.fmean(gaps) if gaps else None,
+            "inter_token_p50_s": statistics.median(gaps) if gaps else None,
+            "inter_token_p95_s": statistics.quantiles(gaps, n=20)[-1] if len(gaps) > 1 else None,
+            "total_s": self.total_seconds,
+            "node_seconds": dict(self.node_seconds),
+        }
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Turns LangChain/LangGraph callbacks into ``microbe.tracing`` spans: one per
+    graph node (``node.<name>``), LLM call (``llm``), tool call (``tool.<name>``)
+    and retriever call (``retrieval``), nested after the run tree.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._spans = {}
+        # Run id -> span of its nearest traced ancestor, for runs without a span of their own
+        self._parents = {}
+
+    def _parent(self, parent_run_id):
+        return self._spans.get(parent_run_id) or self._parents.get(parent_run_id)
+
+    def _start(self, name, run_id, parent_run_id, **attributes):
+        self._spans[run_id] = tracing.start_span(name, parent=self._parent(parent_run_id), **attributes)
+
+    def _finish(self, run_id, error=None, **attributes):
+        self._parents.pop(run_id, None)
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.set(**attributes)
+            span.finish(error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            self._start(f"node.{node}", run_id, parent_run_id)
+        elif self._parent(parent_run_id) is not None:
+            self._parents[run_id] = self._parent(parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start("llm", run_id, parent_run_id, model=(kwargs.get("metadata") or {}).get("ls_model_name"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start("llm", run_id, parent_run_id, model=(kwargs.get("metadata") or {}).get("ls_model_name"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+        self._finish(run_id, input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self._start(f"tool.{(serialized or {}).get('name') or kwargs.get('name')}", run_id, parent_run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start("retrieval", run_id, parent_run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._finish(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+
+def run_config():
+    """Invocation config for the agent graph: the tracing callbacks while tracing is on, else nothing."""
+    return {"callbacks": [TracingCallbackHandler()]} if tracing.is_enabled() else None
+
+
 class SimpleDietModel:
-    def __init__(self, model_id, model_provider, retriever, tools=None):
+    def __init__(self, model_id, model_provider, retriever, tools=None, cache=None, llm=None, response_cache=None,
+                 retriever_version=None):
         self.model_id = model_id
         self.model_provider = model_provider
         self.retriever = retriever
         self.tools = tools
+        # Optional ToolCache serving repeated GuidelineRetriever queries, invalidated when
+        # retriever_version() changes (e.g. lambda: prepare_vectorstore.vectorstore_version(db_name))
+        self.cache = cache
+        self.retriever_version = retriever_version
+        # Chat model instance; defaults to the shared client from get_chat_model
+        self.llm = llm
+        # Optional ResponseCache serving repeated or near-duplicate prompts to invoke_model
+        self.response_cache = response_cache
+        self._app = None
 
     def set_tools(self, tools):
         """
@@ -23,15 +180,28 @@ class SimpleDietModel:
         Args:
             tools: List of tools to be used by the agent.
         """
+        if tools != self.tools:
+            self._app = None
         self.tools = tools
 
+    def get_llm(self):
+        if self.llm is None:
+            self.llm = get_chat_model(self.model_provider, self.model_id)
+        return self.llm
+
     def get_runnable_app(self):
+        """Return the compiled agent graph, built once and reused until ``set_tools`` changes the tools."""
+        if self._app is None:
+            self._app = self.build_runnable_app()
+        return self._app
+
+    def build_runnable_app(self):
         class AgentState(TypedDict):
             messages: Annotated[list[BaseMessage], "chat_history"]
 
         # Build the ReAct agent node
         agent_node = create_react_agent(
-            model=":".join([self.model_provider, self.model_id]),
+            model=self.get_llm(),
             tools=self.tools,
         )
 
@@ -51,14 +221,47 @@ class SimpleDietModel:
     def get_ollama_llm(self):
         return OllamaLLM(model=self.model_id)
 
+    def warm_up(self):
+        """
+        Build the app and load the model with a one-token request, so the first timed call pays neither.
+
+        Returns:
+            float: Seconds spent warming up.
+        """
+        start = time.perf_counter()
+        self.get_runnable_app()
+        llm = self.get_llm()
+        if self.model_provider == "ollama":
+            llm = llm.bind(options={"num_predict": 1})
+        llm.invoke([HumanMessage(content="Hi")])
+        return time.perf_counter() - start
+
     def retrieve_docs(self, query: str):
-        results = self.retriever.get_relevant_documents(query)
+        if self.cache is not None:
+            return self.cache.get_or_compute("GuidelineRetriever", query, self._retrieve_docs, self.retriever_version)
+        return self._retrieve_docs(query)
+
+    def _retrieve_docs(self, query: str):
+        with tracing.span("retrieval.guidelines") as span:
+            results = self.retriever.get_relevant_documents(query)
+            span.set(documents=len(results))
         return "\n".join([doc.page_content for doc in results])
 
+    async def aretrieve_docs(self, query: str):
+        """Async retrieve_docs; the blocking Chroma lookup runs in a worker thread."""
+        if self.cache is not None:
+            return await self.cache.aget_or_compute("GuidelineRetriever", query, self._aretrieve_docs,
+                                                    self.retriever_version)
+        return await self._aretrieve_docs(query)
+
+    async def _aretrieve_docs(self, query: str):
+        return await asyncio.to_thread(self._retrieve_docs, query)
+
     def get_rag_tool(self):
         return Tool(
         name="GuidelineRetriever",
         func=self.retrieve_docs,
+        coroutine=self.aretrieve_docs,
         description="Retrieves food guideline passages relevant to a user query"
     )
 
@@ -75,29 +278,123 @@ class SimpleDietModel:
         state["messages"].append(AIMessage(content=final_msg))
         return state
 
-    def invoke_model(self, messages):
+    def invoke_app(self, messages):
+        """
+        Run the agent graph on the given messages.
+
+        Returns:
+            dict: The final graph state; ``state["messages"]`` holds every message, tool calls included.
+        """
+        return self.get_runnable_app().invoke({"messages": messages}, config=run_config())
+
+    async def ainvoke_app(self, messages):
+        """Async invoke_app; tool calls emitted in one agent step run concurrently."""
+        return await self.get_runnable_app().ainvoke({"messages": messages}, config=run_config())
+
+    async def astream_model(self, messages):
+        """
+        Stream a run of the agent as it happens.
+
+        Yields dicts with a ``type``:
+            - ``"token"``: ``text`` of the next chunk of model output.
+            - ``"tool_start"`` / ``"tool_end"``: ``name`` and ``input`` / ``output`` of a tool call.
+            - ``"retrieval"``: ``documents`` returned by a retriever.
+            - ``"node_end"``: ``node`` path (e.g. ``"agent/tools"``) and ``seconds`` of a finished graph node.
+            - ``"end"``: the final ``response`` and ``metrics`` (a ``StreamMetrics`` summary).
+        """
+        metrics = StreamMetrics()
+        node_starts = {}
+        state = None
+        async for event in self.get_runnable_app().astream_events({"messages": messages}, config=run_config(),
+                                                                 version="v2"):
+            kind = event["event"]
+            metadata = event.get("metadata", {})
+            node = metadata.get("langgraph_node")
+            # Nested graph nodes are named by their path, e.g. "agent/tools" inside the "agent" node
+            path = "/".join(part.split(":")[0] for part in metadata.get("langgraph_checkpoint_ns", "").split("|"))
+            if kind == "on_chat_model_stream":
+                text = event["data"]["chunk"].content
+                if isinstance(text, str) and text:
+                    metrics.add_token()
+                    yield {"type": "token", "text": text, "node": path}
+            elif kind == "on_tool_start":
+                yield {"type": "tool_start", "name": event["name"], "input": event["data"].get("input")}
+            elif kind == "on_tool_end":
+                output = event["data"].get("output")
+                yield {"type": "tool_end", "name": event["name"], "output": getattr(output, "content", output)}
+            elif kind == "on_retriever_end":
+                documents = event["data"].get("output") or []
+                yield {"type": "retrieval", "documents": [doc.page_content for doc in documents]}
+            elif kind == "on_chain_start" and node is not None and event["name"] == node:
+                node_starts[event["run_id"]] = metrics.elapsed()
+            elif kind == "on_chain_end" and event["run_id"] in node_starts:
+                seconds = metrics.elapsed() - node_starts.pop(event["run_id"])
+                metrics.add_node(path or node, seconds)
+                yield {"type": "node_end", "node": path or node, "seconds": seconds}
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                state = event["data"].get("output")
+        metrics.total_seconds = metrics.elapsed()
+        response = final_response(state["messages"]) if isinstance(state, dict) and "messages" in state else None
+        yield {"type": "end", "response": response, "metrics": metrics.summary()}
+
+    def stream_model(self, messages):
+        """Blocking ``astream_model`` for callers without an event loop (not from inside Jupyter's)."""
+        loop = asyncio.new_event_loop()
+        events = self.astream_model(messages)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(events.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(events.aclose())
+            loop.close()
+
+    def cached_response(self, messages, use_cache=True):
+        """The response cache's answer to ``messages``, or None on a miss (or without a cache)."""
+        if self.response_cache is None:
+            return None
+        if not use_cache:
+            self.response_cache.bypass()
+            return None
+        return self.response_cache.lookup(self.model_id, messages)
+
+    def cache_response(self, messages, response, use_cache=True):
+        if self.response_cache is not None and use_cache:
+            self.response_cache.store(self.model_id, messages, response)
+
+    def invoke_model(self, messages, use_cache=True):
         """
         Invoke the model with the given messages.
 
         Args:
-            app: The runnable app created from the graph.
             messages: List of messages to send to the model.
+            use_cache (bool): Serve and store the response through ``response_cache``; False bypasses it.
 
         Returns:
             The response from the model.
         """
-        app = self.get_runnable_app()
-
-        # Prepare the initial state
-        state = {"messages": messages}
+        cached = self.cached_response(messages, use_cache)
+        if cached is not None:
+            return cached
+        response = final_response(self.invoke_app(messages)["messages"])
+        self.cache_response(messages, response, use_cache)
+        return response
 
-        # Run the app
-        response = app.invoke(state)
+    async def ainvoke_model(self, messages, use_cache=True):
+        """Async invoke_model, so many sessions can share one event loop."""
+        cached = await asyncio.to_thread(self.cached_response, messages, use_cache)
+        if cached is not None:
+            return cached
+        response = final_response((await self.ainvoke_app(messages))["messages"])
+        await asyncio.to_thread(self.cache_response, messages, response, use_cache)
+        return response
 
-        final_response = None
-        for message in reversed(response['messages']):
-            if isinstance(message, AIMessage) and message.content.strip():
-                final_response = message.content
-                break
 
-        return final_response
\ No newline at end of file
+def final_response(messages):
+    """Content of the last non-empty AIMessage, or None."""
+    for message in reversed(messages):
+        if isinstance(message, AIMessage) and message.content.strip():
+            return message.content
+    return None
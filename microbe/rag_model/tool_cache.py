@@ -0,0 +1,192 @@
+# Result cache for agent tool calls (NutrientCalculator, FoodSelector, GuidelineRetriever)
+import functools
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Prefix of the messages the tools return on failure (DB outage, timeout, unknown food)
+ERROR_PREFIX = "❌"
+
+
+def normalize_argument(value):
+    """Cache-key form of a tool argument: case-folded, whitespace collapsed, "a | b" spacing unified."""
+    value = " ".join(str(value).split()).casefold()
+    return re.sub(r"\s*\|\s*", " | ", value)
+
+
+def is_cacheable(value):
+    """Default ``should_cache``: everything but the tools' ``"❌ ..."`` error messages."""
+    return not (isinstance(value, str) and value.startswith(ERROR_PREFIX))
+
+
+class ToolCache:
+    """
+    Size-bounded LRU cache for tool results, with optional TTL and disk tier.
+
+    Entries are grouped by namespace (one per tool). Each namespace can carry
+    a ``version`` callable, e.g. ``nutrient_calculator.cnf_data_version``;
+    whenever it returns a new value the namespace is dropped from both tiers.
+    The on-disk tier is a SQLite file that can be shared across runs.
+    Results rejected by ``should_cache`` (by default the tools' error
+    messages) are returned but not stored, so a transient failure is
+    recomputed on the next call.
+
+    Args:
+        max_size (int): Entries kept in memory before evicting the least recently used.
+        ttl (float): Seconds an entry stays valid, or ``None`` to keep it until evicted.
+        persist_path (str): SQLite file for the persistent tier, or ``None`` for memory only.
+        version_check_interval (float): Seconds between calls to a namespace's ``version``.
+        should_cache (callable): Predicate on a computed result; False results are not stored.
+    """
+
+    def __init__(self, max_size=1024, ttl=None, persist_path=None, version_check_interval=5.0,
+                 should_cache=is_cacheable):
+        self.max_size = max_size
+        self.should_cache = should_cache
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache ("
+                "namespace TEXT, key TEXT, version TEXT, value TEXT, created REAL, PRIMARY KEY (namespace, key))")
+            self._db.commit()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0,
+                      "hit_seconds": 0.0, "miss_seconds": 0.0}
+
+    def summary(self):
+        """Hit rate and mean latency of hits and misses, on top of the raw counters."""
+        stats = dict(self.stats)
+        hits = stats["hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["size"] = len(self._entries)
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        stats["mean_hit_ms"] = 1000 * stats["hit_seconds"] / hits if hits else 0.0
+        stats["mean_miss_ms"] = 1000 * stats["miss_seconds"] / stats["misses"] if stats["misses"] else 0.0
+        return stats
+
+    def _current_version(self, namespace, version):
+        """Return the namespace version, re-reading it at most every ``version_check_interval``."""
+        if version is None:
+            return ""
+        now = time.monotonic()
+        seen = self._versions.get(namespace)
+        if seen is not None and now - seen[1] < self.version_check_interval:
+            return seen[0]
+        current = str(version())
+        if seen is not None and seen[0] != current:
+            self.invalidate(namespace)
+        self._versions[namespace] = (current, now)
+        return current
+
+    def invalidate(self, namespace=None):
+        """Drop one namespace (or everything) from both tiers."""
+        with self._lock:
+            for key in [k for k in self._entries if namespace is None or k[0] == namespace]:
+                del self._entries[key]
+            if self._db is not None:
+                if namespace is None:
+                    self._db.execute("DELETE FROM tool_cache")
+                else:
+                    self._db.execute("DELETE FROM tool_cache WHERE namespace = ?", (namespace,))
+                self._db.commit()
+            self.stats["invalidations"] += 1
+
+    def _get(self, key, version):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, entry_version, created = entry
+            if entry_version == version and (self.ttl is None or time.time() - created < self.ttl):
+                self._entries.move_to_end(key)
+                return value, "hits"
+            del self._entries[key]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, version, created FROM tool_cache WHERE namespace = ? AND key = ?", key).fetchone()
+            if row is not None and row[1] == version and (self.ttl is None or time.time() - row[2] < self.ttl):
+                value = json.loads(row[0])
+                self._put(key, value, version, row[2], persist=False)
+                return value, "disk_hits"
+        return None, None
+
+    def _put(self, key, value, version, created, persist=True):
+        self._entries[key] = (value, version, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        if persist and self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO tool_cache VALUES (?, ?, ?, ?, ?)",
+                             (*key, version, json.dumps(value), created))
+            self._db.commit()
+
+    def _lookup(self, namespace, argument, version, start):
+        """Return (key, current version, hit, value) for one lookup, counting hits."""
+        key = (namespace, normalize_argument(argument))
+        with self._lock:
+            current = self._current_version(namespace, version)
+            value, tier = self._get(key, current)
+            if tier is not None:
+                self.stats[tier] += 1
+                self.stats["hit_seconds"] += time.perf_counter() - start
+            return key, current, tier is not None, value
+
+    def _store(self, key, value, version, start):
+        with self._lock:
+            if self.should_cache(value):
+                self._put(key, value, version, time.time())
+            self.stats["misses"] += 1
+            self.stats["miss_seconds"] += time.perf_counter() - start
+
+    def get_or_compute(self, namespace, argument, compute, version=None):
+        """Return the cached result of ``compute(argument)``, computing and storing it on a miss."""
+        start = time.perf_counter()
+        key, current, hit, value = self._lookup(namespace, argument, version, start)
+        if not hit:
+            value = compute(argument)
+            self._store(key, value, current, start)
+        return value
+
+    async def aget_or_compute(self, namespace, argument, compute, version=None):
+        """Async ``get_or_compute``: ``compute`` is a coroutine function, awaited only on a miss."""
+        start = time.perf_counter()
+        key, current, hit, value = self._lookup(namespace, argument, version, start)
+        if not hit:
+            value = await compute(argument)
+            self._store(key, value, current, start)
+        return value
+
+    def wrap(self, func, namespace=None, version=None):
+        """Return ``func`` with its single argument served through the cache."""
+        namespace = namespace or func.__name__
+
+        @functools.wraps(func)
+        def cached(argument):
+            return self.get_or_compute(namespace, argument, func, version)
+
+        return cached
+
+    def awrap(self, func, namespace=None, version=None):
+        """Async ``wrap`` for a coroutine function; shares entries with ``wrap`` under the same namespace."""
+        namespace = namespace or func.__name__
+
+        @functools.wraps(func)
+        async def cached(argument):
+            return await self.aget_or_compute(namespace, argument, func, version)
+
+        return cached
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,264 @@
+# Lightweight spans and timers for the hot paths: tools, retrieval, database, embeddings and LLM calls
+import asyncio
+import contextvars
+import functools
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# Set to "1" to trace from import time; otherwise call enable()
+TRACE_ENV = "MICROBE_TRACE"
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+# Durations sampled per span name for the percentiles, so a long-running process keeps bounded memory
+RESERVOIR_SIZE = 2048
+
+_enabled = os.environ.get(TRACE_ENV) == "1"
+_current_span = contextvars.ContextVar("microbe_current_span", default=None)
+_current_trace = contextvars.ContextVar("microbe_current_trace", default=None)
+_span_ids = itertools.count(1)
+_durations = {}
+_durations_lock = threading.Lock()
+
+
+def enable(enabled=True):
+    """Turn tracing on or off for the whole process."""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+class _Histogram:
+    """
+    Fixed ``HISTOGRAM_BUCKETS_MS`` counts, totals and a uniform sample of
+    ``RESERVOIR_SIZE`` durations (reservoir sampling) for the percentiles.
+    """
+
+    __slots__ = ("count", "total_ms", "max_ms", "buckets", "reservoir", "_random")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.reservoir = []
+        self._random = random.Random(0)
+
+    def record(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[int(np.searchsorted(HISTOGRAM_BUCKETS_MS, ms, side="left"))] += 1
+        if len(self.reservoir) < RESERVOIR_SIZE:
+            self.reservoir.append(ms)
+        else:
+            slot = self._random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.reservoir[slot] = ms
+
+
+class Span:
+    """
+    One timed operation. Nested spans link to their parent through a context
+    variable, so nesting follows threads started with ``asyncio.to_thread``
+    and asyncio tasks. Finished spans feed the process-wide histograms and
+    the ``Trace`` active when they started, if any.
+    """
+
+    __slots__ = ("id", "name", "attributes", "parent_id", "trace", "start", "end", "thread", "_token")
+
+    def __init__(self, name, attributes, parent=None):
+        parent = parent if parent is not None else _current_span.get()
+        self.id = next(_span_ids)
+        self.name = name
+        self.attributes = attributes
+        self.parent_id = parent.id if parent is not None else None
+        self.trace = _current_trace.get()
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+        self._token = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error=None):
+        self.end = time.perf_counter()
+        if error is not None:
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+        with _durations_lock:
+            if self.name not in _durations:
+                _durations[self.name] = _Histogram()
+            _durations[self.name].record((self.end - self.start) * 1e3)
+        if self.trace is not None:
+            self.trace.add(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.finish(exc)
+        return False
+
+
+class _NoopSpan:
+    """Returned by ``span()`` while tracing is off; does nothing."""
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **attributes):
+    """Context manager timing a block: ``with tracing.span("db.query", table="food"): ...``."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def start_span(name, parent=None, **attributes):
+    """Start a span finished explicitly with ``.finish()`` (for callback-style start/end events)."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes, parent)
+
+
+def traced(name=None):
+    """
+    Decorator wrapping every call of a function (sync or async) in a span named
+    ``name`` (default: ``module.function``). Calls go straight through while
+    tracing is off.
+    """
+    def decorator(func):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await func(*args, **kwargs)
+                with Span(span_name, {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Trace:
+    """The spans of one run (e.g. one agent turn), exportable as a trace file."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, finished_span):
+        with self._lock:
+            self.spans.append(finished_span)
+
+    def summary(self):
+        """Total seconds and count per span name."""
+        totals = defaultdict(lambda: {"count": 0, "total_s": 0.0})
+        for s in self.spans:
+            totals[s.name]["count"] += 1
+            totals[s.name]["total_s"] += s.duration
+        return dict(totals)
+
+    def export(self, path):
+        """
+        Write the spans in the Chrome trace-event format (open in Perfetto or
+        chrome://tracing); one row per thread, nested spans stacked.
+        """
+        origin = min((s.start for s in self.spans), default=0.0)
+        events = [{"name": s.name, "ph": "X", "pid": os.getpid(), "tid": s.thread,
+                   "ts": (s.start - origin) * 1e6, "dur": s.duration * 1e6,
+                   "args": {"id": s.id, "parent_id": s.parent_id,
+                            **{k: v if isinstance(v, (int, float, str, bool, type(None))) else str(v)
+                               for k, v in s.attributes.items()}}}
+                  for s in sorted(self.spans, key=lambda s: s.start)]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"name": self.name, "summary": self.summary()}}, f)
+        return path
+
+
+class trace_run:
+    """Collect the spans started inside the block (this task/thread context) into a ``Trace``."""
+
+    def __init__(self, name=None):
+        self.trace = Trace(name)
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        return False
+
+
+def histograms():
+    """
+    Latency distribution of every span name recorded so far in this process.
+    Counts, totals, mean, max and buckets are exact; the percentiles come from
+    a sample of up to ``RESERVOIR_SIZE`` durations per name.
+
+    Returns:
+        dict: ``{name: {"count", "total_s", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+        "buckets": {"<=1ms": n, ..., ">30000ms": n}}}``.
+    """
+    labels = [f"<={b:g}ms" for b in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]:g}ms"]
+    result = {}
+    with _durations_lock:
+        for name, h in sorted(_durations.items()):
+            p50, p95, p99 = np.percentile(h.reservoir, [50, 95, 99])
+            result[name] = {"count": h.count, "total_s": h.total_ms / 1e3, "mean_ms": h.total_ms / h.count,
+                            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": h.max_ms,
+                            "buckets": dict(zip(labels, h.buckets))}
+    return result
+
+
+def export_histograms(path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(histograms(), f, indent=1)
+    return path
+
+
+def reset_histograms():
+    with _durations_lock:
+        _durations.clear()
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from microbe.cnf_api import cnf_migrations
+from microbe.cnf_api.food_index import TRGM_INDEXES
+
+# Scratch CNF database the migration may alter, e.g. postgresql://postgres@localhost/cnf_test
+DATABASE_URL = os.environ.get("CNF_TEST_DATABASE_URL")
+
+
+@pytest.fixture(scope="module")
+def engine():
+    if not DATABASE_URL:
+        pytest.skip("CNF_TEST_DATABASE_URL is not set")
+    engine = create_engine(DATABASE_URL)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1 FROM food LIMIT 1"))
+    except OperationalError as e:
+        pytest.skip(f"CNF test database unreachable: {e}")
+    yield engine
+    engine.dispose()
+
+
+def test_migrate_schema_is_idempotent(engine):
+    cnf_migrations.migrate_schema(engine)
+    assert cnf_migrations.migrate_schema(engine) == []
+
+
+def test_unique_constraint_covers_value(engine):
+    cnf_migrations.migrate_schema(engine)
+    with engine.connect() as conn:
+        definition = conn.execute(text("SELECT indexdef FROM pg_indexes WHERE indexname = :name"),
+                                  {"name": "uq_nutrient_amount_food_nutrient"}).scalar()
+    assert definition is not None and "INCLUDE (value)" in definition
+
+
+def test_calculator_queries_use_indexes(engine):
+    cnf_migrations.migrate_schema(engine)
+    report = cnf_migrations.explain_calculator_queries(engine)
+    assert all(result["ok"] for result in report.values()), report
+
+
+def test_trigram_indexes(engine):
+    with engine.connect() as conn:
+        available = conn.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar()
+    if not available:
+        pytest.skip("pg_trgm is not available on the test server")
+    cnf_migrations.migrate_schema(engine, trigram=True)
+    with engine.connect() as conn:
+        indexes = {row[0] for row in conn.execute(text("SELECT indexname FROM pg_indexes"))}
+    assert set(TRGM_INDEXES) <= indexes
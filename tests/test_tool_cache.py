@@ -0,0 +1,61 @@
+import asyncio
+
+from microbe.rag_model.tool_cache import ToolCache
+
+
+def flaky_tool(failures):
+    """Tool returning the tools' error message for its first ``failures`` calls, then a result."""
+    calls = []
+
+    def tool(argument):
+        calls.append(argument)
+        if len(calls) <= failures:
+            return "❌ Error calculating nutrients: connection refused"
+        return f"✅ {argument}: 74 kcal"
+
+    return tool, calls
+
+
+def test_error_results_are_recomputed(tmp_path):
+    tool, calls = flaky_tool(failures=1)
+    cache = ToolCache(persist_path=str(tmp_path / "tool_cache.sqlite"))
+    cached = cache.wrap(tool, "NutrientCalculator")
+
+    assert cached("Butter | 10g").startswith("❌")
+    assert cached("Butter | 10g") == "✅ Butter | 10g: 74 kcal"
+    assert cached("butter |10g") == "✅ Butter | 10g: 74 kcal"
+    assert len(calls) == 2
+    cache.close()
+
+    # The error never reached the disk tier; the recovered result did
+    reopened = ToolCache(persist_path=str(tmp_path / "tool_cache.sqlite"))
+    assert reopened.wrap(tool, "NutrientCalculator")("Butter | 10g") == "✅ Butter | 10g: 74 kcal"
+    assert len(calls) == 2
+    reopened.close()
+
+
+def test_async_error_results_are_recomputed():
+    tool, calls = flaky_tool(failures=1)
+
+    async def atool(argument):
+        return tool(argument)
+
+    cache = ToolCache()
+    cached = cache.awrap(atool, "GuidelineRetriever")
+
+    async def run():
+        return [await cached("live microbe foods") for _ in range(3)]
+
+    first, second, third = asyncio.run(run())
+    assert first.startswith("❌") and second == third
+    assert len(calls) == 2
+    assert cache.summary()["misses"] == 2
+
+
+def test_should_cache_predicate():
+    tool, calls = flaky_tool(failures=0)
+    cache = ToolCache(should_cache=lambda value: False)
+    cached = cache.wrap(tool, "FoodSelector")
+    cached("Almond butter")
+    cached("Almond butter")
+    assert len(calls) == 2